@@ -1,4 +1,5 @@
-from analyze.value_of_information import admits_voi_list
+import networkx as nx
+from analyze.trimming import trimmed_links
 from core.cid import CID
 
 
@@ -17,19 +18,17 @@ def introduced_total_effect(cid: CID, A: str, D: str, Y: str, a1, a2) -> float:
 
 # TODO find a better place to put this
 def trimmed(cid: CID) -> CID:
-    """Return the trimmed version of the graph
+    """Return the trimmed version of the graph, as a CID without CPDs
 
     Based on algorithm from Sect 4.5 of Lauritzen and Nilsson 2011, but simplified
-    uusing the assumption that the graph is soluble"""
-    new = cid.copy()
-    decisions = cid.decision_nodes
-    while True:
-        removed = 0
-        for decision in decisions:
-            nonrequisite = admits_voi_list(cid, decision)
-            for nr in nonrequisite:
-                removed += 1
-                new.remove_edge(nr, decision)
-        if removed == 0:
-            break
+    uusing the assumption that the graph is soluble: the information links from parents
+    without value of information are removed, until no more links can be removed
+    (see analyze.trimming.trimmed_links)"""
+    removed = set(trimmed_links(cid, cid.decision_nodes, cid.utility_nodes))
+    new = CID([], decision_nodes=[], utility_nodes=[])
+    # the edges are a subset of an acyclic graph's, so pgmpy's per-edge cycle check is bypassed
+    nx.DiGraph.add_nodes_from(new, cid.nodes)
+    nx.DiGraph.add_edges_from(new, [edge for edge in cid.edges if edge not in removed])
+    new.decision_nodes = list(cid.decision_nodes)
+    new.utility_nodes = list(cid.utility_nodes)
     return new
@@ -1,49 +1,122 @@
 # Licensed to the Apache Software Foundation (ASF) under one or more contributor license
 # agreements; and to You under the Apache License, Version 2.0.
 
-from typing import List, Set
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import networkx as nx
 from pgmpy.models import BayesianModel
 
+# a search state (node, upward), where upward means that the trail entered node from one of its children
+TrailState = Tuple[str, bool]
 
-def _active_neighbours(bn: BayesianModel, path: List[str], observed: List[str]) -> Set[str]:
-    """Find possibly active extensions of path conditional on observed"""
-    end_of_path = path[-1]
-    last_forward = len(path) > 1 and end_of_path in bn.get_children(path[-2])
-    possible_colliders = set().union(*[set(bn._get_ancestors_of(e)) for e in observed])
 
-    # if going upward or at a possible collider, it's possible to continue to a parent
-    if end_of_path in possible_colliders or not last_forward:
-        active_parents = set(bn.get_parents(end_of_path)) - set(observed)
-    else:
-        active_parents = set()
-
-    # it's possible to go downward if and only if not an observed node
-    if end_of_path in observed:
-        active_children = set()
-    else:
-        active_children = set(bn.get_children(end_of_path))
+def ancestors_of(graph: nx.DiGraph, nodes: Iterable[str]) -> Set[str]:
+    """Return the given nodes together with all their ancestors"""
+    ancestors = set(nodes)
+    queue = deque(ancestors)
+    while queue:
+        for parent in graph.predecessors(queue.popleft()):
+            if parent not in ancestors:
+                ancestors.add(parent)
+                queue.append(parent)
+    return ancestors
 
-    active_neighbours = active_parents.union(active_children)
-    new_active_neighbours = active_neighbours - set(path)
-    return new_active_neighbours
-
-
-def _find_active_path_recurse(bn: BayesianModel, path: List[str],
-                              end_node: str, observed: List[str]) -> List[str]:
-    """Find active path from `path' to `end_node' given `observed'"""
-    if path[-1] == end_node and end_node not in observed:
-        return path
-    else:
-        neighbours = _active_neighbours(bn, path, observed)
-        for neighbour in neighbours:
-            ext = _find_active_path_recurse(bn, path + [neighbour], end_node, observed)
-            if ext:
-                return ext
 
+def _trail_successors(bn: BayesianModel, state: TrailState, observed: Set[str],
+                      possible_colliders: Set[str]) -> Iterator[TrailState]:
+    """Generate the states an active trail can continue to from state
 
-def find_active_path(bn: BayesianModel, start_node: str, end_node: str, observed: List[str]) -> List[str]:
-    """Find active path from `start_node' to `end_node' given `observed'"""
-    return _find_active_path_recurse(bn, [start_node], end_node, observed)
+    possible_colliders are the observed nodes and their ancestors.
+    """
+    node, upward = state
+    if upward and node in observed:
+        return
+    if upward or node in possible_colliders:
+        for parent in bn.predecessors(node):
+            yield parent, True
+    if node not in observed:
+        for child in bn.successors(node):
+            yield child, False
+
+
+def active_trail_search(bn: BayesianModel, sources: Iterable[str],
+                        observed: Iterable[str]) -> Dict[TrailState, Optional[TrailState]]:
+    """Breadth-first search over the trails from `sources' that are active given `observed'
+
+    Returns a dictionary mapping every reachable state (node, upward) to the state it was first
+    reached from, or to None for the sources. Each source is entered as if from a child.
+    A node is d-connected to the sources iff it is reached in some state and is not observed,
+    and each state is visited at most once, so the search is linear in the size of the graph.
+    Only the graph structure is used, so bn can also be a plain networkx DiGraph.
+    """
+    observed = set(observed)
+    possible_colliders = ancestors_of(bn, observed)
+    predecessors = {(source, True): None for source in sources}
+    queue = deque(predecessors)
+    while queue:
+        state = queue.popleft()
+        for successor in _trail_successors(bn, state, observed, possible_colliders):
+            if successor not in predecessors:
+                predecessors[successor] = state
+                queue.append(successor)
+    return predecessors
+
+
+def find_active_path(bn: BayesianModel, start_node: str, end_node: str,
+                     observed: Iterable[str]) -> Optional[List[str]]:
+    """Find a shortest active path from `start_node' to `end_node' given `observed'
+
+    The path is read off an active_trail_search from start_node, so it's found in time linear
+    in the size of the graph. Returns None if there is no active path.
+    """
+    observed = set(observed)
+    if end_node in observed:
+        return None
+    predecessors = active_trail_search(bn, [start_node], observed)
+    paths = []
+    for state in [(end_node, True), (end_node, False)]:
+        if state in predecessors:
+            path = []
+            while state is not None:
+                path.append(state[0])
+                state = predecessors[state]
+            paths.append(path[::-1])
+    return min(paths, key=len) if paths else None
+
+
+def iter_active_paths(bn: BayesianModel, start_node: str, end_node: str, observed: Iterable[str],
+                      max_length: int = None) -> Iterator[List[str]]:
+    """Generate the active paths from `start_node' to `end_node' given `observed', one at a time
+
+    The paths are enumerated by an iterative depth-first search that only extends active prefixes,
+    so the memory used is proportional to the length of the current path, and the search stops
+    when the caller stops iterating. With max_length, only paths of at most max_length edges are generated.
+    """
+    observed = set(observed)
+    if start_node in observed or end_node in observed:
+        return
+    if start_node == end_node:
+        yield [start_node]
+        return
+    possible_colliders = ancestors_of(bn, observed)
+    path = [start_node]
+    on_path = {start_node}
+    stack = [_trail_successors(bn, (start_node, True), observed, possible_colliders)]
+    while stack:
+        for node, upward in stack[-1]:
+            if node in on_path:
+                continue
+            if node == end_node:
+                if max_length is None or len(path) <= max_length:
+                    yield path + [node]
+            elif max_length is None or len(path) < max_length:
+                path.append(node)
+                on_path.add(node)
+                stack.append(_trail_successors(bn, (node, upward), observed, possible_colliders))
+                break
+        else:
+            stack.pop()
+            on_path.discard(path.pop())
 
 
 def get_motifs(cid, path):
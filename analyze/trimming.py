@@ -0,0 +1,73 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more contributor license
+# agreements; and to You under the Apache License, Version 2.0.
+
+"""Trimming of the information links that have no value of information
+
+The functions only use the graph structure, so they apply to CIDs and MACIDs alike
+(and to plain networkx DiGraphs), without depending on core.
+"""
+from collections import deque
+from typing import Iterable, List, Set, Tuple
+import networkx as nx
+from analyze.get_paths import active_trail_search, ancestors_of
+
+
+def _voi_sweep(graph: nx.DiGraph, decision: str,
+               utilities: Iterable[str]) -> Tuple[Set[str], Set[str], Set[str], Set[str]]:
+    """Return the nodes that admit value of information for decision, and what the result depends on
+
+    The result can only change when an edge X -> Y is removed if X or Y was reached by the search,
+    Y is an ancestor of (or in) Fa_D, so that the search's possible colliders change, or X is the
+    decision or one of its descendants. So besides the VoI nodes, the reached nodes, the ancestors
+    of Fa_D and the descendants of the decision are returned.
+    """
+    descendants = nx.descendants(graph, decision)
+    utils = [util for util in utilities if util in descendants]
+    if not utils:  # without utility nodes downstream of the decision, no node will have VoI
+        return set(), set(), set(), descendants
+    observed = [decision] + list(graph.predecessors(decision))
+    reached = {node for node, _ in active_trail_search(graph, utils, observed)}
+    fa_ancestors = ancestors_of(graph, observed)
+    return reached - descendants - {decision}, reached, fa_ancestors, descendants
+
+
+def voi_nodes(graph: nx.DiGraph, decision: str, utilities: Iterable[str]) -> Set[str]:
+    """Return the set of nodes that admit value of information for decision
+
+    A node X admits VoI if it's not a descendant of the decision, and it is d-connected
+    to a utility node that descends from the decision, given Fa_D without X.
+    All of them are found with a single Bayes-ball search from the utility nodes given Fa_D:
+    an unobserved node is d-connected given Fa_D iff it's reached, and a reached parent
+    of the decision is a requisite observation (Shachter 1998).
+    """
+    return _voi_sweep(graph, decision, utilities)[0]
+
+
+def trimmed_links(graph: nx.DiGraph, decisions: Iterable[str], utilities: Iterable[str]) -> List[Tuple[str, str]]:
+    """Return the information links that trimming the graph removes, in the order they are removed
+
+    Repeatedly, the links into a decision from parents without value of information are removed,
+    until none are left (see Sect 4.5 of Lauritzen and Nilsson 2011). After a removal, only the
+    decisions whose VoI nodes may depend on the removed link are analysed again (see _voi_sweep).
+    The graph itself is left unchanged.
+    """
+    utilities = list(utilities)
+    work = nx.DiGraph(graph.edges)
+    work.add_nodes_from(graph.nodes)
+    dependencies = {}
+    queue = deque(decisions)
+    queued = set(queue)
+    removed = []
+    while queue:
+        decision = queue.popleft()
+        queued.discard(decision)
+        voi, *dependencies[decision] = _voi_sweep(work, decision, utilities)
+        for parent in [p for p in work.predecessors(decision) if p not in voi]:
+            work.remove_edge(parent, decision)
+            removed.append((parent, decision))
+            for other, (reached, fa_ancestors, descendants) in dependencies.items():
+                if other not in queued and (parent in reached or decision in reached or decision in fa_ancestors
+                                            or parent in descendants or parent == other):
+                    queue.append(other)
+                    queued.add(other)
+    return removed
@@ -4,65 +4,102 @@ Criterion for Information incentive on X:
     (i) X is not a descendent of the decison node, D.
     (ii) U∈Desc(D) (U must be a descendent of D)
     (iii) X is d-connected to U | Fa_D\{X}"""
-from typing import List
+from typing import List, Set, Tuple
 
 import networkx as nx
+import numpy as np
 
+from analyze.trimming import voi_nodes
 from core.cid import CID
 from core.macid import MACID
+from core.parallel import WorkerPool
 
 
-def admits_voi(cid: CID, decision: str, node: str, agent=None) -> bool:
-    """Return True if cid admits value of information for node and decision"""
-
+def _voi_nodes(cid: CID, decision: str, agent=None) -> Set[str]:
+    """Return the set of nodes that admit value of information for decision (see analyze.trimming.voi_nodes)"""
     if agent:
         assert isinstance(cid, MACID)
         agent_utils = cid.utility_nodes[agent]  # this agent's utility nodes
     else:
         agent_utils = cid.utility_nodes  # this agent's utility nodes
+    return voi_nodes(cid, decision, agent_utils)
 
-    if not agent_utils:  # if the agent has no decision or no utility nodes, no node will have VoI
-        return False
+
+def admits_voi(cid: CID, decision: str, node: str, agent=None) -> bool:
+    """Return True if cid admits value of information for node and decision"""
     if node not in cid.nodes:
         raise ValueError(f"{node} is not present in the cid")
-
-    # condition (i)
-    elif node == decision or node in nx.descendants(cid, decision):
-        return False
-
-    for util in agent_utils:
-        if util in nx.descendants(cid, decision):  # condition (ii)
-            con_nodes = [decision] + cid.get_parents(decision)  # nodes to be conditioned on
-            if node in con_nodes:  # remove node from condition nodes
-                con_nodes.remove(node)
-            if cid.is_active_trail(node, util, con_nodes):  # condition (iv)
-                return True
-    else:
-        return False
+    return node in _voi_nodes(cid, decision, agent=agent)
 
 
 def admits_voi_list(cid: CID, decision: str, agent=None) -> List[str]:
     """Return list of nodes with possible value of information for decision"""
-    if agent:
-        assert isinstance(cid, MACID)
-        agent_utils = cid.utility_nodes[agent]  # this agent's utility nodes
-    else:
-        agent_utils = cid.utility_nodes  # this agent's utility nodes
-
-    if not agent_utils:  # if the agent has no utility nodes, there's no VoI
-        return []
-    else:
-        return [x for x in list(cid.nodes) if admits_voi(cid, decision, x, agent=agent)]
+    result = _voi_nodes(cid, decision, agent=agent)
+    return [x for x in cid.nodes if x in result]
 
 
 def voi(cid: CID, decision: str, variable: str):
     # TODO test this method
     new = cid.copy()
-    new.add_edge(variable, decision)
+    if not new.has_edge(variable, decision):
+        new.add_edge(variable, decision)
     new.impute_optimal_policy()
     ev1 = new.expected_utility({})
     new = cid.copy()
-    new.remove_edge(variable, decision)
+    if new.has_edge(variable, decision):
+        new.remove_edge(variable, decision)
     new.impute_optimal_policy()
     ev2 = new.expected_utility({})
-    return ev1 - ev2
\ No newline at end of file
+    return ev1 - ev2
+
+
+def _toggled_link_eu(cid: CID, solved: CID, decision: str, variable: str) -> float:
+    """Return the expected utility of the optimal policy for cid, with the link from variable to decision
+    added if absent, or removed if present
+
+    solved is cid with its optimal policy. The decisions after decision keep their policies from solved
+    (unless the order of the decisions changes), and only the others are solved again.
+    Returns nan if the modified CID lacks sufficient recall.
+    """
+    new = cid.copy()
+    if new.has_edge(variable, decision):
+        new.remove_edge(variable, decision)
+    else:
+        new.add_edge(variable, decision)
+    if not new.check_sufficient_recall():
+        return np.nan
+    order = new._get_valid_order(new.decision_nodes)
+    to_solve = order
+    if order == solved._get_valid_order(solved.decision_nodes):
+        # with sufficient recall, the policies of later decisions don't depend on what decision observes
+        later = order[order.index(decision) + 1:]
+        if later:
+            new.add_cpds(*[solved.get_cpds(d).copy() for d in later])
+        to_solve = order[:order.index(decision) + 1]
+    for d in reversed(to_solve):
+        new.impute_optimal_decision(d)
+    return new.expected_utility({})
+
+
+def voi_all(cid: CID, decision: str, n_jobs: int = 1) -> List[Tuple[str, float]]:
+    """Return the value of information (see voi) of each possible observation for decision,
+    as a list of (node, VoI) pairs sorted from highest to lowest VoI
+
+    The possible observations are the nodes that don't descend from the decision.
+    The CID is solved once, and the modified CIDs, with the information link from a node added
+    or removed, only need the decision and the decisions before it solved again. Each modified CID
+    compiles its own inference engine, since the decision's parents, and so its CPD, differ from the CID's.
+    With n_jobs > 1 (or -1 for all CPUs), the modified CIDs are solved in a pool of processes,
+    which receive the CID and its solution once. Modified CIDs that lack sufficient recall
+    get VoI nan, and are listed last.
+    """
+    solved = cid.copy()
+    solved.impute_optimal_policy()
+    baseline = solved.expected_utility({})
+    descendants = nx.descendants(cid, decision)
+    candidates = [node for node in cid.nodes if node != decision and node not in descendants]
+    with WorkerPool(n_jobs, cid, solved, decision, tasks=len(candidates)) as pool:
+        eus = pool.map(_toggled_link_eu, [(node,) for node in candidates])
+    table = [(node, baseline - eu if cid.has_edge(node, decision) else eu - baseline)
+             for node, eu in zip(candidates, eus)]
+    return sorted(table, key=lambda row: (np.isnan(row[1]), 0 if np.isnan(row[1]) else -row[1], row[0]))
@@ -0,0 +1,70 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more contributor license
+# agreements; and to You under the Apache License, Version 2.0.
+
+from __future__ import annotations
+import os
+import logging
+import tempfile
+from typing import Dict, Optional
+import numpy as np
+
+
+class SolutionCache:
+    """On-disk cache of solutions (e.g. of CID.solve and CID.expected_utility), keyed by content hash
+
+    Each entry is an .npz file in the cache directory. Reading an entry marks it as recently used,
+    and when the total size of the entries exceeds max_bytes, the least recently used ones are deleted.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".npz")
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def load(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """Return the arrays stored under key, or None if there are none"""
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logging.warning(f"removing unreadable cache entry {path}")
+            os.remove(path)
+            return None
+        return arrays
+
+    def save(self, key: str, **arrays: np.ndarray) -> None:
+        """Store the arrays under key, and evict the least recently used entries if the cache is too large"""
+        fd, tmp_path = tempfile.mkstemp(suffix=".npz.tmp", dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, self._path(key))  # so that readers never see a partially written entry
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def clear(self) -> None:
+        """Remove all entries"""
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                os.remove(os.path.join(self.directory, name))
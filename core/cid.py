@@ -2,16 +2,70 @@
 # agreements; and to You under the Apache License, Version 2.0.
 
 from __future__ import annotations
+import copy
+import hashlib
+import itertools
+import json
 from functools import lru_cache
 import matplotlib.pyplot as plt
 import numpy as np
-from pgmpy.factors.discrete import TabularCPD
-from pgmpy.models import BayesianModel
+from pgmpy.factors.discrete import TabularCPD, DiscreteFactor
+from pgmpy.models import BayesianModel, JunctionTree
+from pgmpy.factors import factor_product
 import logging
-from typing import List, Tuple, Dict, Any, Callable
+from typing import List, Tuple, Dict, Any, Callable, Iterable, Union
 from pgmpy.inference.ExactInference import BeliefPropagation
 import networkx as nx
 from core.cpd import UniformRandomCPD, FunctionCPD, DecisionDomain
+from core.inference import inference_engine
+from core.cache import SolutionCache
+from core.parallel import WorkerPool
+from analyze.get_paths import active_trail_search
+
+
+def _expectation(factor: DiscreteFactor, variable: str) -> float:
+    """Return the expected value of variable under the (normalized) factor
+
+    The factor is contracted against a vector of the variable's state values,
+    so that the joint distribution is never iterated over in Python.
+    """
+    state_values = np.array(factor.state_names[variable], dtype=float)
+    axis = factor.variables.index(variable)
+    return float(np.tensordot(np.moveaxis(factor.values, axis, 0), state_values, axes=(0, 0)).sum())
+
+
+def _expected_value_table(cid: CID, bp, variable: str, context_vars: List[str]) -> np.ndarray:
+    """CID._expected_value_table, with the arguments in the order used by a WorkerPool"""
+    return cid._expected_value_table(variable, context_vars, bp)
+
+
+def _optimal_action(cid: CID, bp, d: str, pv: tuple) -> Any:
+    """CID._optimal_action, using the compiled engine bp, with the arguments in the order used by a WorkerPool"""
+    if cid._engines is None:  # a pickled CID doesn't carry its engines
+        cid._engines = (cid._engine_key(), {("bp", frozenset()): bp})
+    return cid._optimal_action(d, pv)
+
+
+def _plain(value: Any) -> Any:
+    """Convert numpy scalars to the corresponding python values, so they have a stable repr"""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _shared_copy(cpd: TabularCPD) -> TabularCPD:
+    """Return a shallow copy of cpd, that shares its (read-only) value array
+
+    pgmpy replaces rather than writes to the value array when it changes a CPD,
+    so the copy and the original can safely be changed independently.
+    """
+    new = copy.copy(cpd)
+    # a FunctionCPD keeps its table in _values and output_index (see FunctionCPD.values)
+    for attr in ["values", "_values", "output_index"]:
+        if vars(cpd).get(attr) is not None:
+            vars(cpd)[attr].flags.writeable = False
+    for attr in ["variables", "state_names", "name_to_no", "no_to_name"]:
+        if hasattr(cpd, attr):
+            setattr(new, attr, copy.copy(getattr(cpd, attr)))
+    return new
 
 
 class CID(BayesianModel):
@@ -19,6 +73,12 @@ class CID(BayesianModel):
     def __init__(self, edges: List[Tuple[str, str]],
                  decision_nodes: List[str],
                  utility_nodes: List[str]):
+        self._structure_version = 0
+        self._cpd_version = 0
+        self._engines = None  # (version key, {(backend, intervention): engine}) for the current model
+        self._relevance_cache = None  # (structure key, mechanism graph, {(query, observed): decisions})
+        self.memory_budget = None  # bytes; inference that needs a larger factor raises a MemoryError
+        self._content_hash = None  # (version key, hash)
         super(CID, self).__init__(ebunch=edges)
         self.decision_nodes = decision_nodes
         self.utility_nodes = utility_nodes
@@ -26,15 +86,67 @@ class CID(BayesianModel):
         assert set(self.nodes).issuperset(self.utility_nodes)
         self.cpds_to_add = {}
 
-    def add_cpds(self, *cpds: TabularCPD, update_all: bool = True) -> None:
+    def __getstate__(self) -> Dict:
+        """Pickle the CID without its inference engines, which are rebuilt when needed
+
+        FunctionCPDs whose function can't be pickled are pickled as lookup tables (see FunctionCPD).
+        """
+        state = self.__dict__.copy()
+        state["_engines"] = None
+        state["_relevance_cache"] = None
+        return state
+
+    def _model_changed(self, structure: bool = False) -> None:
+        """Record that the model has changed, so that cached inference gets recompiled"""
+        if structure:
+            self._structure_version += 1
+        self._cpd_version += 1
+
+    def add_edge(self, u: str, v: str, **kwargs) -> None:
+        super(CID, self).add_edge(u, v, **kwargs)
+        self._model_changed(structure=True)
+        self._mark_for_reinitialization(v)
+
+    def remove_edge(self, u: str, v: str) -> None:
+        super(CID, self).remove_edge(u, v)
+        self._model_changed(structure=True)
+        self._mark_for_reinitialization(v)
+
+    def remove_node(self, node: str) -> None:
+        super(CID, self).remove_node(node)
+        self._model_changed(structure=True)
+
+    def remove_edges_from(self, ebunch: Iterable[Tuple[str, str]]) -> None:
+        ebunch = list(ebunch)
+        super(CID, self).remove_edges_from(ebunch)
+        self._model_changed(structure=True)
+        for edge in ebunch:
+            if edge[1] in self:
+                self._mark_for_reinitialization(edge[1])
+
+    def remove_nodes_from(self, nodes: Iterable[str]) -> None:
+        super(CID, self).remove_nodes_from(nodes)
+        self._model_changed(structure=True)
+
+    def remove_cpds(self, *cpds: Union[TabularCPD, str]) -> None:
+        super(CID, self).remove_cpds(*cpds)
+        self._model_changed()
+
+    def _mark_for_reinitialization(self, node: str) -> None:
+        """Make the next call to add_cpds re-initialize the CPD of node, if it depends on the parents"""
+        if not hasattr(self, "cpds"):  # the graph is still being constructed
+            return
+        cpd = self.get_cpds(node)
+        if hasattr(cpd, "initialize_tabular_cpd") and node not in self.cpds_to_add:
+            self.cpds_to_add[node] = cpd
+
+    def add_cpds(self, *cpds: TabularCPD, update_all: bool = False) -> None:
         """Add the given CPDs and initiate NullCPDs and FunctionCPDs
 
+        Besides the added CPDs, only the UniformRandomCPDs and FunctionCPDs of nodes whose
+        parents have changed their state_names (and so on, recursively) are re-initialized.
         The update_all option recomputes the state_names and matrices for all CPDs in the graph.
-        It can be set to false to save time, if the added CPD(s) have identical state_names to
-        the ones they are replacing.
         """
-        # TODO: get rid of update_all, by instead adding any children of a node whose state_names
-        #       have changed to cpds_to_add
         if update_all:
             for cpd in self.cpds:
                 self.cpds_to_add[cpd.variable] = cpd
@@ -45,33 +157,115 @@ class CID(BayesianModel):
         for var in nx.topological_sort(self):
             if var in self.cpds_to_add:
                 cpd = self.cpds_to_add[var]
+                old_cpd = self.get_cpds(var)
+                old_state_names = list(old_cpd.state_names[var]) if old_cpd else None
                 if hasattr(cpd, "initialize_tabular_cpd"):
                     cpd.initialize_tabular_cpd(self)
-                if hasattr(cpd, "values"):
+                if hasattr(cpd, "variables"):  # initialized, without building a FunctionCPD's table
                     super(CID, self).add_cpds(cpd)
                     del self.cpds_to_add[var]
+                    if cpd.state_names[var] != old_state_names:
+                        for child in self.get_children(var):
+                            self._mark_for_reinitialization(child)
+        self._model_changed()
+
+    def _engine_key(self) -> Tuple[int, int, int]:
+        """The versions of the model and the memory budget that the cached engines were compiled for"""
+        return self._structure_version, self._cpd_version, self.memory_budget
+
+    def _inference_engine(self, intervention: dict = None, backend: str = "bp"):
+        """Return an inference engine for the current model, under an optional intervention
+
+        The backend is either "bp" (pgmpy's BeliefPropagation) or "einsum" (see core.inference).
+        Engines, with their calibrated junction trees or elimination plans, are reused across
+        queries, and only rebuilt after add_cpds, add_edge or remove_edge has changed the model,
+        or the memory budget has changed. Engines for interventions are cached in the same way
+        (see _overlay_engine).
+        """
+        key = self._engine_key()
+        if self._engines is None or self._engines[0] != key:
+            self._engines = (key, {})
+        engines = self._engines[1]
+        do = frozenset(intervention.items()) if intervention else frozenset()
+        if (backend, do) not in engines:
+            if backend == "bp" and do:
+                engines[(backend, do)] = self._overlay_engine(intervention)
+            else:
+                engines[(backend, do)] = inference_engine(self, backend, intervention, self.memory_budget)
+        return engines[(backend, do)]
+
+    def _overlay_engine(self, intervention: dict) -> BeliefPropagation:
+        """Compile a BeliefPropagation engine for do(intervention), without copying the model
+
+        The intervened factors are replaced with deterministic ones over the same scope,
+        so the junction tree of the observational engine can be reused, and only the clique
+        potentials are recomputed. All intervened values must be in the variables' domains.
+        """
+        junction_tree = self._inference_engine().junction_tree
+        factors = []
+        for cpd in self.cpds:
+            factor = cpd.to_factor()
+            if cpd.variable in intervention:
+                idx = cpd.state_names[cpd.variable].index(intervention[cpd.variable])
+                values = np.zeros(factor.values.shape)
+                values[idx] = 1
+                factor.values = values
+            factors.append(factor)
+
+        overlay = JunctionTree(junction_tree.edges())
+        overlay.add_nodes_from(junction_tree.nodes())
+        unused = list(range(len(factors)))
+        for clique in junction_tree.nodes():
+            # as in pgmpy, each factor goes into the first clique that contains its scope
+            clique_factors = [factors[i] for i in unused if set(factors[i].scope()).issubset(clique)]
+            unused = [i for i in unused if not set(factors[i].scope()).issubset(clique)]
+            card = [self.get_cardinality(v) for v in clique]
+            potential = DiscreteFactor(clique, card, np.ones(np.product(card)))
+            if clique_factors:
+                potential *= factor_product(*clique_factors)
+            overlay.add_factors(potential)
+        return BeliefPropagation(overlay)
 
     def _get_valid_order(self, nodes: List[str]):
         srt = [i for i in nx.topological_sort(self) if i in nodes]
         return srt
 
-    def check_sufficient_recall(self) -> bool:
+    def sufficient_recall_violations(self) -> List[Tuple[str, str, str]]:
+        """Return a (decision1, decision2, utility) triple for each decision1 that a later decision2
+        has insufficient recall of, with a utility of decision2 that witnesses the violation
+
+        decision2 has insufficient recall of decision1 if a (hypothetical) policy parent of decision1
+        is d-connected to a utility node downstream of decision2, given decision2 and its parents.
+        This is found with one active trail search per decision2, starting from its utility nodes.
+        """
+        violations = []
         decision_ordering = self._get_valid_order(self.decision_nodes)
-        for i, decision1 in enumerate(decision_ordering):
-            for j, decision2 in enumerate(decision_ordering[i+1:]):
-                for utility in self.utility_nodes:
-                    if decision2 in self._get_ancestors_of(utility):
-                        cid_with_policy = self.copy()
-                        cid_with_policy.add_edge('pi', decision1)
-                        observed = cid_with_policy.get_parents(decision2) + [decision2]
-                        connected = cid_with_policy.is_active_trail('pi', utility, observed=observed)
-                        if connected:
-                            logging.warning(
-                                    "{} has insufficient recall of {} due to utility {}".format(
-                                        decision2, decision1, utility)
-                                    )
-                            return False
-        return True
+        for j, decision2 in enumerate(decision_ordering):
+            descendants = nx.descendants(self, decision2)
+            utilities = [u for u in self.utility_nodes if u in descendants]
+            observed = self.get_parents(decision2) + [decision2]
+            possible_colliders = self._get_ancestors_of(observed)
+            reached = active_trail_search(self, utilities, observed)
+            for decision1 in decision_ordering[:j]:
+                # the trail can continue from decision1 to its policy parent if it enters
+                # decision1 from a child and decision1 is unobserved, or if decision1 is a possible collider
+                if (decision1, True) in reached and decision1 not in observed:
+                    state = (decision1, True)
+                elif (decision1, False) in reached and decision1 in possible_colliders:
+                    state = (decision1, False)
+                else:
+                    continue
+                while reached[state] is not None:
+                    state = reached[state]
+                violations.append((decision1, decision2, state[0]))
+        return violations
+
+    def check_sufficient_recall(self) -> bool:
+        violations = self.sufficient_recall_violations()
+        for decision1, decision2, utility in violations:
+            logging.warning("{} has insufficient recall of {} due to utility {}".format(
+                decision2, decision1, utility))
+        return not violations
 
     def impute_random_decision(self, d: str) -> None:
         """Impute a random policy to the given decision node"""
@@ -87,34 +281,73 @@ class CID(BayesianModel):
         for d in self.decision_nodes:
             self.impute_random_decision(d)
 
-    def impute_optimal_decision(self, d: str) -> None:
-        """Impute an optimal policy to the given decision node"""
+    def impute_optimal_decision(self, d: str, tabular: bool = True, n_jobs: int = 1) -> None:
+        """Impute an optimal policy to the given decision node
+
+        By default, the expected utility of every (parents, action) combination is computed
+        in one pass with expected_utility_table, and the policy is installed as a TabularCPD
+        that picks the first action maximizing expected utility. Parent configurations that
+        have probability zero get the first action.
+        With tabular=False, the policy is instead a FunctionCPD that evaluates
+        expected_utility separately for each parent configuration.
+
+        With n_jobs > 1 (or -1 for all CPUs), the work is spread over a pool of processes:
+        the queries for the different utility nodes if tabular, and otherwise the parent
+        configurations. The result is identical to that of the serial computation.
+        """
         self.impute_random_decision(d)
         card = self.get_cardinality(d)
         parents = self.get_parents(d)
-        idx2name = self.get_cpds(d).no_to_name[d]
         state_names = self.get_cpds(d).state_names
+        if tabular:
+            eu = self.expected_utility_table(parents + [d], n_jobs=n_jobs)
+            eu = np.where(np.isnan(eu), -np.inf, eu).reshape(-1, card)
+            # ties up to floating point error are broken in favour of the first action
+            best = np.argmax(np.isclose(eu, eu.max(axis=1, keepdims=True)), axis=1)
+            matrix = np.zeros((card, len(best)))
+            matrix[best, np.arange(len(best))] = 1
+            policy_state_names = {d: state_names[d], **{p: self.get_cpds(p).state_names[p] for p in parents}}
+            self.add_cpds(TabularCPD(d, card, matrix, parents, [self.get_cardinality(p) for p in parents],
+                                     state_names=policy_state_names),
+                          update_all=False)
+            return
+
         new = self.copy()  # this "freezes" the policy so it doesn't adapt to future interventions
+        precomputed = {}
+        if n_jobs != 1:
+            configurations = list(itertools.product(*[self.get_cpds(p).state_names[p] for p in parents]))
+            bp = new._inference_engine()  # compiled once, and sent to the workers with the model
+            with WorkerPool(n_jobs, new, bp, tasks=len(configurations)) as pool:
+                actions = pool.map(_optimal_action, [(d, pv) for pv in configurations])
+            precomputed = dict(zip(configurations, actions))
 
         @lru_cache(maxsize=1000)
         def opt_policy(*pv: tuple):
-            context = {p: pv[i] for i, p in enumerate(parents)}
-            eu = []
-            for d_idx in range(card):
-                context[d] = d_idx
-                eu.append(new.expected_utility(context))
-            return idx2name[np.argmax(eu)]
+            if pv in precomputed:
+                return precomputed[pv]
+            return new._optimal_action(d, pv)
 
         self.add_cpds(FunctionCPD(d, opt_policy, parents, state_names=state_names, label="opt"),
                       update_all=False)
 
-    def impute_optimal_policy(self) -> None:
-        """Impute a subgame perfect optimal policy to all decision nodes"""
+    def _optimal_action(self, d: str, pv: tuple) -> Any:
+        """Return the first action of d that maximizes expected utility, given the values pv of its parents"""
+        context = {p: pv[i] for i, p in enumerate(self.get_parents(d))}
+        eu = []
+        for d_idx in range(self.get_cardinality(d)):
+            context[d] = d_idx
+            eu.append(self.expected_utility(context))
+        return self.get_cpds(d).no_to_name[d][np.argmax(eu)]
+
+    def impute_optimal_policy(self, tabular: bool = True, n_jobs: int = 1) -> None:
+        """Impute a subgame perfect optimal policy to all decision nodes
+
+        See impute_optimal_decision for the tabular and n_jobs options."""
         if not self.check_sufficient_recall():
             raise Exception("CID lacks sufficient recall, so cannot be solved by backwards induction")
         decisions = reversed(self._get_valid_order(self.decision_nodes))
         for d in decisions:
-            self.impute_optimal_decision(d)
+            self.impute_optimal_decision(d, tabular=tabular, n_jobs=n_jobs)
 
     def impute_conditional_expectation_decision(self, d: str, y: str) -> None:
         """Imputes a policy for d = the expectation of y conditioning on d's parents"""
@@ -128,15 +361,70 @@ class CID(BayesianModel):
 
         self.add_cpds(FunctionCPD(d, cond_exp_policy, parents, label="cond_exp({})".format(y)))
 
-    def solve(self) -> Dict:
+    def solve(self, tabular: bool = True, cache: SolutionCache = None, n_jobs: int = 1) -> Dict:
         """Return dictionary with subgame perfect global policy
 
         to impute back the result, use add_cpds(*list(cid.solve().values())),
-        or the impute_optimal_policy method
+        or the impute_optimal_policy method (see impute_optimal_decision for the tabular
+        and n_jobs options)
+
+        If a cache is given, a solution of an identical model (see content_hash) is read from it,
+        and new solutions are stored in it. Only tabular policies can be cached.
         """
+        if cache is not None:
+            if not tabular:
+                raise ValueError("only tabular policies can be cached")
+            key = self._cache_key("solve")
+            stored = cache.load(key)
+            if stored is not None:
+                policy = {}
+                for i, (d, evidence, evidence_card, names) in enumerate(json.loads(str(stored["decisions"]))):
+                    policy[d] = TabularCPD(d, len(names[d]), stored[f"policy_{i}"], evidence, evidence_card,
+                                           state_names=names)
+                return policy
+
         new_cid = self.copy()
-        new_cid.impute_optimal_policy()
-        return {d: new_cid.get_cpds(d) for d in new_cid.decision_nodes}
+        new_cid.impute_optimal_policy(tabular=tabular, n_jobs=n_jobs)
+        policy = {d: new_cid.get_cpds(d) for d in new_cid.decision_nodes}
+
+        if cache is not None:
+            decisions = [(d, cpd.variables[1:], [int(c) for c in cpd.cardinality[1:]],
+                          {v: [_plain(name) for name in cpd.state_names[v]] for v in cpd.variables})
+                         for d, cpd in policy.items()]
+            try:
+                arrays = {"decisions": np.array(json.dumps(decisions))}
+            except TypeError:
+                logging.warning("the solution was not cached, since the decisions' state names are not JSON values")
+                return policy
+            arrays.update({f"policy_{i}": policy[d].get_values() for i, d in enumerate(policy)})
+            cache.save(key, **arrays)
+        return policy
+
+    def content_hash(self) -> str:
+        """Return a hash of the graph, the decision and utility nodes, and the CPD tables
+
+        Identical models have the same hash, also across sessions, so it can be used as a key
+        for a persistent cache (see core.cache). FunctionCPDs are hashed by their table
+        after initialization, rather than by their function.
+        """
+        key = (self._structure_version, self._cpd_version, tuple(self.decision_nodes), tuple(self.utility_nodes))
+        if self._content_hash is not None and self._content_hash[0] == key:
+            return self._content_hash[1]
+        h = hashlib.sha256()
+        h.update(repr((sorted(self.nodes), sorted(self.edges),
+                       sorted(self.decision_nodes), sorted(self.utility_nodes))).encode())
+        for cpd in sorted(self.get_cpds(), key=lambda c: c.variable):
+            table = cpd.output_index if getattr(cpd, "output_index", None) is not None else cpd.values
+            h.update(repr((type(cpd).__name__, cpd.variables, [[_plain(name) for name in cpd.state_names.get(v, [])]
+                                                               for v in cpd.variables],
+                           table.dtype.str, table.shape)).encode())
+            h.update(np.ascontiguousarray(table).tobytes())
+        self._content_hash = (key, h.hexdigest())
+        return self._content_hash[1]
+
+    def _cache_key(self, *args: Any) -> str:
+        """Return a cache key for the result of a computation on this model, described by args"""
+        return hashlib.sha256(repr((self.content_hash(),) + args).encode()).hexdigest()
 
     def mechanism_graph(self) -> CID:
         """Returns a mechanism graph with an extra parent node+"mec" for each node"""
@@ -146,23 +434,56 @@ class CID(BayesianModel):
             mg.add_edge(node+"mec", node)
         return mg
 
-    def _query(self, query: List[str], context: Dict[str, Any], intervention: dict = None):
+    def _relevant_decisions(self, query: List[str], observed: List[str]) -> List[str]:
+        """Return the decisions whose policy can affect the query given observed
+
+        A decision is relevant if its mechanism is d-connected to a query node in the mechanism graph.
+        The answers are memoized, and the mechanism graph built once, until the structure changes.
+        """
+        key = (self._structure_version, tuple(self.decision_nodes))
+        if self._relevance_cache is None or self._relevance_cache[0] != key:
+            self._relevance_cache = (key, self.mechanism_graph(), {})
+        _, mech_graph, relevant = self._relevance_cache
+        query_key = (frozenset(query), frozenset(observed))
+        if query_key not in relevant:
+            active = mech_graph.active_trail_nodes([d+"mec" for d in self.decision_nodes], observed=list(observed))
+            relevant[query_key] = [d for d in self.decision_nodes if not active[d+"mec"].isdisjoint(query)]
+        return relevant[query_key]
+
+    def _check_policies_specified(self, query: List[str], observed: List[str]) -> None:
+        """Check that the graph is sufficiently instantiated to determine the query,
+        in particular that strategically relevant decisions have a policy specified"""
+        for decision in self._relevant_decisions(query, observed):
+            cpd = self.get_cpds(decision)
+            if not cpd:
+                raise Exception(f"no DecisionDomain specified for {decision}")
+            elif isinstance(cpd, DecisionDomain):
+                raise Exception(f"query {query}|{observed} depends on {decision}, but no policy imputed for it")
+
+    def _intervened(self, intervention: dict = None, backend: str = "bp") -> Tuple[CID, Any]:
+        """Return the model that results from the intervention, and an inference engine for it
+
+        The model is self, with an overlay engine, unless an intervened value is outside
+        the variable's domain, in which case the model is an intervened copy.
+        """
+        if intervention and any(value not in self.get_cpds(variable).state_names[variable]
+                                for variable, value in intervention.items()):
+            cid = self.copy()
+            cid.intervene(intervention)
+            return cid, cid._inference_engine(backend=backend)
+        return self, self._inference_engine(intervention, backend)
+
+    def _query(self, query: List[str], context: Dict[str, Any], intervention: dict = None,
+               joint: bool = True, backend: str = "bp"):
         """Return P(query|context, do(intervention))*P(context | do(intervention)).
 
         Use factor.normalize to get p(query|context, do(intervention)).
-        Use context={} to get P(query). """
-
-        # check that graph is sufficiently instantiated to determine query,
-        # in particular that strategically relevant decisions have a policy specified
-        mech_graph = self.mechanism_graph()
-        for decision in self.decision_nodes:
-            for query_node in query:
-                if mech_graph.is_active_trail(decision+"mec", query_node, observed=list(context.keys())):
-                    cpd = self.get_cpds(decision)
-                    if not cpd:
-                        raise Exception(f"no DecisionDomain specified for {decision}")
-                    elif isinstance(cpd, DecisionDomain):
-                        raise Exception(f"query {query}|{context} depends on {decision}, but no policy imputed for it")
+        Use context={} to get P(query).
+        With joint=False, a dictionary with the marginal factor of each query node is returned instead,
+        all computed from the same calibrated junction tree.
+        The inference backend is "bp" (BeliefPropagation) or "einsum" (see core.inference). """
+
+        self._check_policies_specified(query, list(context.keys()))
 
         # query fails if graph includes nodes not in moralized graph, so we remove them
         # cid = self.copy()
@@ -171,23 +492,36 @@ class CID(BayesianModel):
         #     if node not in mm.nodes:
         #         cid.remove_node(node)
         # filtered_context = {k:v for k,v in context.items() if k in mm.nodes}
-        if intervention:
-            cid = self.copy()
-            cid.intervene(intervention)
-        else:
-            cid = self
+        cid, bp = self._intervened(intervention, backend)
 
         updated_state_names = {}
         for v in query:
             cpd = cid.get_cpds(v)
             updated_state_names[v] = cpd.state_names[v]
 
-        bp = BeliefPropagation(cid)
+        if not joint:
+            marginals = {}
+            for v in query:
+                marginals[v] = bp.query([v], context)
+                marginals[v].state_names = {v: updated_state_names[v]}
+            return marginals
         # factor = bp.query(query, filtered_context)
         factor = bp.query(query, context)
         factor.state_names = updated_state_names  # factor sometimes gets state_names wrong...
         return factor
 
+    def explain_query(self, query: List[str], context: Dict[str, Any], intervention: dict = None,
+                      heuristic: str = "min_fill") -> Dict[str, Any]:
+        """Return the einsum backend's plan for _query(query, context, intervention), without running it
+
+        The plan has the pruning statistics, the elimination order found with the heuristic
+        ("min_fill", "min_weight" or "weighted_min_fill"), and the predicted treewidth,
+        size in bytes of the largest factor, and number of flops (see core.inference).
+        Set memory_budget to make queries that need a larger factor fail fast with a MemoryError.
+        """
+        _, engine = self._intervened(intervention, "einsum")
+        return engine.explain(query, list(context.keys()), heuristic)
+
     def intervene(self, intervention: dict) -> None:
         """Given a dictionary of interventions, replace the CPDs for the relevant nodes.
 
@@ -195,41 +529,120 @@ class CID(BayesianModel):
         """
         cpds = []
         for variable, value in intervention.items():
-            cpds.append(FunctionCPD(variable, lambda *x: value,
+            cpds.append(FunctionCPD(variable, lambda *x, value=value: value,
                                     evidence=self.get_parents(variable)))
 
         self.add_cpds(*cpds)
 
-    def expected_value(self, variables: List[str], context: dict, intervene: dict = None) -> List[float]:
+    def expected_value(self, variables: List[str], context: dict, intervene: dict = None,
+                       joint: bool = True, backend: str = "bp") -> List[float]:
         """Compute the expected value of a real-valued variable for a given context,
         under an optional intervention
+
+        With joint=False, each expectation is computed from the variable's own marginal,
+        rather than from the joint distribution of all the variables, which is much
+        smaller when there are many variables. The inference backend is chosen as in _query.
         """
-        factor = self._query(variables, context, intervention=intervene)
-        factor.normalize()  # make probs add to one
-
-        ev = np.array([0.0 for _ in factor.variables])
-        for idx, prob in np.ndenumerate(factor.values):
-            # idx contains the information about the value each variable takes
-            # we use state_names to convert index into the actual value of the variable
-            ev += prob * np.array([factor.state_names[variable][idx[var_idx]]
-                                   for var_idx, variable in enumerate(factor.variables)])
-            if np.isnan(ev).any():
-                raise Exception("query {} | {} generated Nan from idx: {}, prob: {}, \
-                                consider imputing a random decision".format(variables, context, idx, prob))
+        if joint:
+            factor = self._query(variables, context, intervention=intervene, backend=backend)
+            factor.normalize()  # make probs add to one
+            ev = np.array([_expectation(factor, variable) for variable in variables])
+        else:
+            marginals = self._query(variables, context, intervention=intervene, joint=False, backend=backend)
+            ev = np.array([_expectation(marginals[variable].normalize(inplace=False), variable)
+                           for variable in variables])
+        if np.isnan(ev).any():
+            raise Exception("query {} | {} generated Nan, \
+                            consider imputing a random decision".format(variables, context))
         return ev.tolist()
 
-    def expected_utility(self, context: Dict["str", "Any"], intervene: dict = None) -> float:
+    def expected_utility(self, context: Dict["str", "Any"], intervene: dict = None,
+                         joint: bool = False, backend: str = "bp", cache: SolutionCache = None) -> float:
         """Compute the expected utility for a given context and optional intervention
 
+        By linearity of expectation, only the marginal of each utility node is needed,
+        so the joint distribution over all utility nodes is only computed if joint=True.
+        If a cache is given, the value is read from it for identical models (see content_hash),
+        or stored in it.
+
         For example:
         cid = get_minimal_cid()
         out = self.expected_utility({'D':1}) #TODO: give example that uses context"""
-        return sum(self.expected_value(self.utility_nodes, context, intervene=intervene))
+        if cache is not None:
+            key = self._cache_key("expected_utility", sorted((k, _plain(v)) for k, v in context.items()),
+                                  sorted((k, _plain(v)) for k, v in intervene.items()) if intervene else None)
+            stored = cache.load(key)
+            if stored is not None:
+                return float(stored["expected_utility"])
+        eu = sum(self.expected_value(self.utility_nodes, context, intervene=intervene, joint=joint,
+                                     backend=backend))
+        if cache is not None:
+            cache.save(key, expected_utility=np.array(eu))
+        return eu
+
+    def _expected_value_table(self, variable: str, context_vars: List[str], bp) -> np.ndarray:
+        """Return E[variable | context_vars] for every joint assignment of context_vars, using bp
+
+        Entries for contexts with probability zero are nan.
+        """
+        query = context_vars if variable in context_vars else context_vars + [variable]
+        factor = bp.query(query)
+        joint = np.moveaxis(factor.values, [factor.variables.index(v) for v in query], range(len(query)))
+        state_values = np.array(self.get_cpds(variable).state_names[variable], dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if variable in context_vars:
+                axis = context_vars.index(variable)
+                shape = [len(state_values) if i == axis else 1 for i in range(len(context_vars))]
+                return joint / joint * state_values.reshape(shape)
+            return np.tensordot(joint, state_values, axes=(-1, 0)) / joint.sum(axis=-1)
+
+    def expected_utility_table(self, context_vars: List[str], intervene: dict = None,
+                               backend: str = "bp", n_jobs: int = 1) -> np.ndarray:
+        """Compute the expected utility for every joint assignment of the context variables
+
+        Entry [i_1, ..., i_k] of the returned array is the expected utility given that
+        context_vars[j] takes its i_j-th state, for each j. Entries for contexts with
+        probability zero are nan. The table is computed with one query per utility node,
+        with the context variables left open, rather than with one query per context.
+        With n_jobs > 1 (or -1 for all CPUs), the queries for the different utility nodes
+        are run in a pool of processes.
+
+        For example:
+        cid = get_3node_cid()
+        cid.impute_random_policy()
+        eu = cid.expected_utility_table(['S', 'D'])  # eu[s, d] = expected_utility({'S': s, 'D': d})
+        """
+        self._check_policies_specified(self.utility_nodes, context_vars)
+        cid, bp = self._intervened(intervene, backend)
+        with WorkerPool(n_jobs, cid, bp, tasks=len(cid.utility_nodes)) as pool:
+            tables = pool.map(_expected_value_table, [(utility, context_vars) for utility in cid.utility_nodes])
+        table = np.zeros([cid.get_cardinality(c) for c in context_vars])
+        for utility_table in tables:
+            table = table + utility_table
+        return table
 
     def copy(self) -> CID:
-        model_copy = CID(self.edges(), decision_nodes=self.decision_nodes, utility_nodes=self.utility_nodes)
-        if self.cpds:
-            model_copy.add_cpds(*[cpd.copy() for cpd in self.cpds])
+        """Return a copy of the CID that shares the CPD tables with this one
+
+        The CPDs are copied without being re-initialized, and their value arrays are shared
+        and made read-only. Changing a CPD of either model (e.g. with add_cpds or intervene)
+        gives that model new arrays, and leaves the other model unaffected.
+        """
+        model_copy = CID([], decision_nodes=[], utility_nodes=[])
+        # the edges are known to be acyclic, so pgmpy's per-edge cycle check is bypassed
+        nx.DiGraph.add_nodes_from(model_copy, self.nodes(data=True))
+        nx.DiGraph.add_edges_from(model_copy, self.edges(data=True))
+        model_copy.decision_nodes = self.decision_nodes
+        model_copy.utility_nodes = self.utility_nodes
+        model_copy.cpds = [_shared_copy(cpd) for cpd in self.cpds]
+        model_copy.cpds_to_add = {var: _shared_copy(cpd) for var, cpd in self.cpds_to_add.items()}
+        # the copy is identical, so it can use the same compiled inference engine
+        model_copy._structure_version = self._structure_version
+        model_copy._cpd_version = self._cpd_version
+        model_copy._engines = self._engines
+        model_copy._relevance_cache = self._relevance_cache
+        model_copy.memory_budget = self.memory_budget
+        model_copy._content_hash = self._content_hash
         return model_copy
 
     def _get_color(self, node: str) -> str:
@@ -11,6 +11,19 @@ from pgmpy.models import BayesianModel
 import numpy as np
 
 
+def _init_without_table(cpd: TabularCPD, variable: str, evidence: List[str], evidence_card: List[int],
+                       state_names: Dict[str, List]) -> None:
+    """Set the attributes of an initialized TabularCPD, except its table
+
+    This does the work of TabularCPD.__init__, which would copy the table into memory.
+    """
+    cpd.variable = variable
+    cpd.variable_card = len(state_names[variable])
+    cpd.variables = [variable] + evidence
+    cpd.cardinality = np.array([cpd.variable_card] + evidence_card, dtype=int)
+    cpd.store_state_names(cpd.variables, cpd.cardinality, state_names)
+
+
 class UniformRandomCPD(TabularCPD):
     """UniformRandomPD class creates a uniform random CPD given parents in graph
 
@@ -26,7 +39,7 @@ class UniformRandomCPD(TabularCPD):
         # we call super().__init__() in initialize_tabular_cpd instead
 
     def copy(self) -> UniformRandomCPD:
-        return UniformRandomCPD(self.variable, self.state_names[self.variable])
+        return UniformRandomCPD(self.variable, self.state_names[self.variable], label=self.label)
 
     def __repr__(self) -> str:
         return f"<UniformRandomCPD {self.variable}:{self.variable_card}>"
@@ -51,46 +64,119 @@ class FunctionCPD(TabularCPD):
     Once inserted into a BayesianModel, initialize_tabular_cpd converts the function
     into a probability matrix for the TabularCPD. It is necessary to wait with this until the values
     of the parents have been computed, since the state names depends on the values of the parents.
+
+    Since the CPD is deterministic, only the index of the variable's state for each joint assignment
+    of the parents is stored (output_index). The dense 0/1 matrix (values) is built each time it's
+    accessed, and not kept.
+
+    If f is a lambda or a local function, which can't be pickled, an initialized FunctionCPD
+    is pickled with f replaced by its lookup table (see freeze).
     """
 
     def __init__(self, variable: str, f: Callable, evidence: List[str],
-                 state_names: Dict = None, label: str = None) -> None:
+                 state_names: Dict = None, label: str = None, vectorized: bool = False) -> None:
         """Initialize FunctionCPD with a variable name and a function
 
         state_names can optionally be provided, to force the domain of the distribution.
         These state_names must include the values the variable can take as a result of its
         function.
+
+        If vectorized is True, f must accept numpy arrays, and is called only once, on arrays
+        with the values of the parents for every joint parent assignment (see numpy.meshgrid).
         """
         self.variable = variable
         self.f = f
         self.evidence = evidence
+        self.vectorized = vectorized
         if state_names:
             assert isinstance(state_names, dict)
             assert isinstance(state_names[variable], list)
             self.force_state_names = state_names[variable]
         else:
             self.force_state_names = None
-        if label:
-            self.label = label
-        else:
-            sl = getsourcelines(self.f)[0][0]
-            lambda_pos = sl.find('lambda')
-            if lambda_pos > -1:  # can't infer label if not defined by lambda expression
-                colon = sl.find(':', lambda_pos, len(sl))
-                end = sl.find(',', colon, len(sl))  # TODO this only works for simple expressions with no commas
-                self.label = sl[colon+2: end]
-            elif hasattr(self.f, "__name__"):
-                self.label = self.f.__name__
-            else:
-                self.label = ""
+        self._label = label if label else None  # if None, it is inferred from the source of f when needed
         # we call super().__init__() in initialize_tabular_cpd instead
 
+    @property
+    def label(self) -> str:
+        if self._label is None:
+            self._label = self._infer_label()
+        return self._label
+
+    @label.setter
+    def label(self, label: str) -> None:
+        self._label = label
+
+    def _infer_label(self) -> str:
+        """Infer a label from the lambda expression that defines f, or otherwise from its name"""
+        try:
+            sl = getsourcelines(self.f)[0][0]
+        except (OSError, TypeError):  # e.g. f was defined interactively
+            sl = ""
+        lambda_pos = sl.find('lambda')
+        if lambda_pos > -1:  # can't infer label if not defined by lambda expression
+            colon = sl.find(':', lambda_pos, len(sl))
+            end = sl.find(',', colon, len(sl))  # TODO this only works for simple expressions with no commas
+            return sl[colon+2: end]
+        elif hasattr(self.f, "__name__"):
+            return self.f.__name__
+        else:
+            return ""
+
     def scope(self) -> List[str]:
         return [self.variable]
 
+    @property
+    def values(self) -> np.ndarray:
+        """The (read-only) probability table, built from output_index"""
+        if self.__dict__.get("_values") is not None:
+            return self._values
+        if self.__dict__.get("output_index") is None:
+            raise AttributeError(f"FunctionCPD for {self.variable} has not been initialized")
+        values = np.moveaxis(np.eye(self.variable_card)[self.output_index], -1, 0)
+        values.flags.writeable = False
+        return values
+
+    @values.setter
+    def values(self, values: np.ndarray) -> None:
+        # the table may no longer be deterministic
+        self._values = values
+        self.output_index = None
+
+    def table_function(self) -> TableFunction:
+        """Return a TableFunction that agrees with f on the values the parents can currently take"""
+        if isinstance(self.f, TableFunction):
+            return self.f
+        if self.__dict__.get("output_index") is None:
+            raise ValueError(f"FunctionCPD for {self.variable} has no table: it has not been initialized, "
+                             f"or its values have been replaced")
+        return TableFunction(self._parent_values, self.state_names[self.variable], self.output_index)
+
+    def freeze(self) -> None:
+        """Replace f by its lookup table (see table_function), e.g. so that the CPD can be pickled"""
+        self._label = self.label
+        self.f = self.table_function()
+        self.vectorized = False
+
+    def __copy__(self) -> FunctionCPD:
+        # copy.copy would otherwise use __getstate__, and freeze f
+        new = FunctionCPD.__new__(FunctionCPD)
+        new.__dict__.update(self.__dict__)
+        return new
+
+    def __getstate__(self) -> Dict:
+        state = self.__dict__.copy()
+        qualname = getattr(self.f, "__qualname__", "")
+        if ("<lambda>" in qualname or "<locals>" in qualname) and self.__dict__.get("output_index") is not None:
+            state["_label"] = self.label
+            state["f"] = self.table_function()
+            state["vectorized"] = False
+        return state
+
     def copy(self) -> FunctionCPD:
         state_names = {self.variable: self.force_state_names} if self.force_state_names else None
-        return FunctionCPD(self.variable, self.f, self.evidence, state_names=state_names)
+        return FunctionCPD(self.variable, self.f, self.evidence, state_names=state_names,
+                           label=self._label, vectorized=self.vectorized)
 
     def __repr__(self) -> str:
         return "<FunctionCPD {}:{}>".format(self.variable, self.f)
@@ -109,20 +195,31 @@ class FunctionCPD(TabularCPD):
                 return None
         return parent_values
 
+    def outputs(self, parent_values: List[List]) -> List:
+        """The value of f for each joint assignment of the parents, in the order of itertools.product"""
+        if not self.vectorized:
+            return [self.f(*x) for x in itertools.product(*parent_values)]
+        grids = np.meshgrid(*[np.array(values) for values in parent_values], indexing="ij")
+        shape = [len(values) for values in parent_values]
+        return np.broadcast_to(self.f(*grids), shape).reshape(-1).tolist()
+
     def possible_values(self, cid: BayesianModel) -> Union[List[List], None]:
         """The possible values this variable can take, given the values the parents can take"""
         parent_values = self.parent_values(cid)
         if parent_values is None:
             return None
         else:
-            return sorted(set([self.f(*x) for x in itertools.product(*parent_values)]))
+            return sorted(set(self.outputs(parent_values)))
 
     def initialize_tabular_cpd(self, cid: BayesianModel) -> bool:
         """Initialize the probability table for the inherited TabularCPD
 
+        f is evaluated once for each joint assignment of the parents.
         Returns True if successful, False otherwise
         """
-        poss_values = self.possible_values(cid)
+        parent_values = self.parent_values(cid)
+        outputs = self.outputs(parent_values) if parent_values is not None else None
+        poss_values = sorted(set(outputs)) if outputs is not None else None
         if not poss_values:
             warning("won't initialize {} at this point".format(self.variable))
             return False
@@ -134,16 +231,36 @@ class FunctionCPD(TabularCPD):
             state_names_list = poss_values
 
         card = len(state_names_list)
-        evidence = cid.get_parents(self.variable)
+        # the matrix columns follow the order of self.evidence, which need not match the order of cid.get_parents
+        evidence = self.evidence
         evidence_card = [cid.get_cardinality(p) for p in evidence]
-        matrix = np.array([[int(self.f(*i) == t)
-                            for i in itertools.product(*self.parent_values(cid))]
-                           for t in state_names_list])
-        state_names = {self.variable: state_names_list}
-
-        super().__init__(self.variable, card,
-                         matrix, evidence, evidence_card,
-                         state_names=state_names)
+        state_index = {t: i for i, t in enumerate(state_names_list)}
+        output_index = np.array([state_index[output] for output in outputs], dtype=np.min_scalar_type(card - 1))
+        # only the sparse representation is stored, rather than the dense matrix
+        _init_without_table(self, self.variable, evidence, evidence_card, {self.variable: state_names_list})
+        self.output_index = output_index.reshape(evidence_card)
+        self._values = None
+        self._parent_values = parent_values  # for table_function
+
+
+class TableFunction:
+    """A function given by a table, e.g. for a FunctionCPD whose original function isn't available
+
+    It maps the values of the parents to output_values[output_index[i_1, ..., i_n]],
+    where i_k is the position of the k-th argument in parent_values[k].
+    """
+
+    def __init__(self, parent_values: List[List], output_values: List, output_index: np.ndarray):
+        self.parent_index = [{value: i for i, value in enumerate(values)} for values in parent_values]
+        self.output_values = output_values
+        self.output_index = output_index
+
+    def __call__(self, *args):
+        index = tuple(parent_index[arg] for parent_index, arg in zip(self.parent_index, args))
+        return self.output_values[self.output_index[index]]
+
+    def __repr__(self) -> str:
+        return f"<TableFunction of {len(self.parent_index)} arguments>"
 
 
 class DecisionDomain(UniformRandomCPD):
@@ -0,0 +1,380 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more contributor license
+# agreements; and to You under the Apache License, Version 2.0.
+
+from __future__ import annotations
+import itertools
+import logging
+import numbers
+import string
+from typing import List, Tuple, Dict, Any, FrozenSet, Union, Set, Iterable, Optional
+import numpy as np
+from pgmpy.factors.discrete import DiscreteFactor
+from pgmpy.models import BayesianModel
+from pgmpy.inference.ExactInference import BeliefPropagation
+
+BACKENDS = ["bp", "einsum"]
+HEURISTICS = ["min_fill", "min_weight", "weighted_min_fill"]
+
+# an elimination step: operand ids, einsum subscripts, and contraction path
+Step = Tuple[List[int], str, Union[bool, list]]
+# a gather: target operand id, index operand id, index template, axis, and the transpose and shape of the index
+Gather = Tuple[int, int, list, int, List[int], List[int]]
+# a contraction: the ids and kinds of the factors used, and the gathers and elimination steps
+Contraction = Tuple[List[int], List[str], List[Gather], List[Step]]
+# a query plan: the contraction into the joint of the query variables, the contraction of the d-separated
+# factors into a scalar (or None), and its statistics
+Plan = Tuple[Contraction, Optional[Contraction], Dict[str, Any]]
+
+
+def elimination_order(scopes: Iterable[Iterable[str]], eliminate: Set[str], cardinality: Dict[str, int],
+                      heuristic: str = "min_fill") -> List[str]:
+    """Return a greedy order for eliminating the given variables from factors with the given scopes
+
+    The heuristic picks the variable that next minimizes either the number of fill-in edges
+    ("min_fill"), the size of the factor created by eliminating it ("min_weight"),
+    or the sum of the sizes of the fill-in edges ("weighted_min_fill").
+    Ties are broken by variable name, so the order is deterministic.
+    """
+    if heuristic not in HEURISTICS:
+        raise ValueError(f"unknown elimination heuristic {heuristic}, choose from {HEURISTICS}")
+    neighbours: Dict[str, Set[str]] = {}
+    for scope in scopes:
+        for v in scope:
+            neighbours.setdefault(v, set()).update(u for u in scope if u != v)
+
+    def cost(v: str) -> int:
+        if heuristic == "min_weight":
+            return int(np.prod([cardinality[u] for u in neighbours[v] | {v}]))
+        fill = [(a, b) for a, b in itertools.combinations(neighbours[v], 2) if b not in neighbours[a]]
+        if heuristic == "min_fill":
+            return len(fill)
+        return sum(cardinality[a] * cardinality[b] for a, b in fill)
+
+    order = []
+    remaining = set(eliminate)
+    while remaining:
+        var = min(sorted(remaining), key=cost)
+        clique = neighbours.pop(var)
+        for u in clique:
+            neighbours[u].update(clique - {u})
+            neighbours[u].discard(var)
+        remaining.remove(var)
+        order.append(var)
+    return order
+
+
+def max_clique_bytes(scopes: Iterable[Iterable[str]], order: List[str], cardinality: Dict[str, int]) -> int:
+    """Return the size in bytes of the largest clique formed by eliminating the variables in order
+    from dense factors with the given scopes"""
+    neighbours: Dict[str, Set[str]] = {}
+    for scope in scopes:
+        for v in scope:
+            neighbours.setdefault(v, set()).update(u for u in scope if u != v)
+    largest = 0
+    for var in order:
+        clique = neighbours.pop(var)
+        largest = max(largest, int(np.prod([cardinality[u] for u in clique | {var}], dtype=float)))
+        for u in clique:
+            neighbours[u].update(clique - {u})
+            neighbours[u].discard(var)
+    return largest * 8
+
+
+class EinsumInference:
+    """Exact inference in a discrete Bayesian network, by variable elimination with numpy.einsum
+
+    query has the same interface, and gives the same results, as BeliefPropagation.query.
+    A plan, consisting of an elimination order and einsum contraction paths, is computed once for
+    each combination of query and evidence variables and then reused, so that answering a query
+    only takes a few einsum calls. Intervened variables are given deterministic CPDs.
+
+    Deterministic CPDs (FunctionCPDs and interventions) are stored as an array with the index
+    of the variable's state for each joint assignment of the parents. Unless the variable is
+    queried or observed, it is then summed out by substituting it with its parents: the factors
+    that contain it are indexed by the array, rather than multiplied with a dense 0/1 table.
+
+    With prune=True, the plan only uses the CPDs of the subnetwork that is relevant to the query:
+    barren nodes (outside the ancestors of the query and evidence) are removed, and the CPDs of
+    nodes d-separated from the query by the evidence are contracted separately into a scalar.
+    This scalar is only zero if the evidence has probability zero, in which case the query is nan,
+    as with BeliefPropagation.
+
+    The elimination order is chosen with one of HEURISTICS (see elimination_order).
+    If a memory budget (in bytes) is given, queries whose plan needs a larger factor
+    raise a MemoryError before any computation is done (see explain).
+    """
+
+    def __init__(self, model: BayesianModel, intervention: Dict[str, Any] = None, prune: bool = True,
+                 heuristic: str = "min_fill", memory_budget: int = None):
+        intervention = intervention if intervention else {}
+        self.state_names: Dict[str, List] = {}
+        self.cardinality: Dict[str, int] = {}
+        # the scope and values of each CPD, or for deterministic CPDs the scope and output index array
+        self.factors: List[Tuple[Tuple[str, ...], np.ndarray]] = []
+        self.deterministic: Set[int] = set()
+        for cpd in model.get_cpds():
+            variable = cpd.variable
+            self.state_names[variable] = list(cpd.state_names[variable])
+            self.cardinality[variable] = cpd.variable_card
+            if variable in intervention:
+                state = self.state_names[variable].index(intervention[variable])
+                values = np.broadcast_to(np.array(state), tuple(cpd.cardinality[1:]))
+                self.deterministic.add(len(self.factors))
+            elif getattr(cpd, "output_index", None) is not None:
+                values = cpd.output_index
+                self.deterministic.add(len(self.factors))
+            else:
+                values = cpd.values
+            self.factors.append((tuple(cpd.variables), values))
+        self.prune = prune
+        self.heuristic = heuristic
+        self.memory_budget = memory_budget
+        self._plans: Dict[Tuple[Tuple[str, ...], FrozenSet[str], str], Plan] = {}
+
+    def _state_index(self, variable: str, state: Any) -> int:
+        """As in pgmpy, the state is looked up by name, and otherwise taken to be an index"""
+        try:
+            return self.state_names[variable].index(state)
+        except ValueError:
+            if isinstance(state, numbers.Integral) and 0 <= state < self.cardinality[variable]:
+                return int(state)
+            raise ValueError(f"{state!r} is neither a state of {variable}, "
+                             f"{self.state_names[variable]}, nor a valid index") from None
+
+    def _relevant_factors(self, variables: Tuple[str, ...],
+                          observed: FrozenSet[str]) -> Tuple[List[int], List[int], int]:
+        """Return the ids of the factors relevant to the query, the ids of the d-separated factors,
+        and the size of the ancestral set
+
+        The relevant factors are those of ancestors of the query and evidence, whose scope
+        (without the evidence) meets the component of the query in the moralized ancestral graph
+        with the evidence removed. The other factors of ancestors are d-separated from the query.
+        """
+        parents = {scope[0]: scope[1:] for scope, _ in self.factors}
+        ancestral = set()
+        stack = list(variables) + list(observed)
+        while stack:
+            v = stack.pop()
+            if v not in ancestral:
+                ancestral.add(v)
+                stack.extend(parents[v])
+        ids = [i for i, (scope, _) in enumerate(self.factors) if scope[0] in ancestral]
+        containing: Dict[str, List[int]] = {}
+        for i in ids:
+            for v in self.factors[i][0]:
+                if v not in observed:
+                    containing.setdefault(v, []).append(i)
+        connected = set(variables)
+        stack = list(variables)
+        while stack:
+            for i in containing[stack.pop()]:
+                for u in self.factors[i][0]:
+                    if u not in observed and u not in connected:
+                        connected.add(u)
+                        stack.append(u)
+        relevant = [i for i in ids if connected.intersection(self.factors[i][0])]
+        return relevant, [i for i in ids if not connected.intersection(self.factors[i][0])], len(ancestral)
+
+    def _plan(self, variables: Tuple[str, ...], observed: FrozenSet[str], heuristic: str = None) -> Plan:
+        """Return the plan that computes the joint of variables, given the observed variables
+
+        First, deterministic variables that are neither queried nor observed are substituted
+        with their parents. Then each step multiplies the factors that contain the next variable in
+        the elimination order, and sums it out. The last step multiplies the remaining factors into the joint.
+        The d-separated factors are contracted into a scalar in the same way.
+        """
+        heuristic = heuristic if heuristic else self.heuristic
+        key = (variables, observed, heuristic)
+        if key in self._plans:
+            return self._plans[key]
+        if self.prune:
+            factor_ids, separated, n_ancestral = self._relevant_factors(variables, observed)
+        else:
+            factor_ids, separated, n_ancestral = list(range(len(self.factors))), [], len(self.factors)
+        stats = {"cpds": len(self.factors), "barren": len(self.factors) - n_ancestral,
+                 "d_separated": len(separated), "relevant": len(factor_ids)}
+        logging.debug(f"query {list(variables)} | {sorted(observed)} uses {stats['relevant']} of {stats['cpds']} "
+                      f"CPDs, pruning {stats['barren']} barren and {stats['d_separated']} d-separated nodes")
+        # each step is costed as if it formed the product of its factors over all its variables
+        cliques: List[Tuple[List[int], int]] = []
+        contraction, order = self._contraction(factor_ids, variables, observed, heuristic, cliques)
+        normalizer = self._contraction(separated, (), observed, heuristic, cliques)[0] if separated else None
+        stats["deterministic"] = contraction[1].count("index")
+        stats["heuristic"] = heuristic
+        stats["order"] = order
+        stats["treewidth"] = max(len(cards) for cards, _ in cliques) - 1
+        stats["max_factor_bytes"] = max(int(np.prod(cards, dtype=float)) for cards, _ in cliques) * 8
+        stats["flops"] = sum(int(np.prod(cards, dtype=float)) * n for cards, n in cliques)
+        self._plans[key] = (contraction, normalizer, stats)
+        return self._plans[key]
+
+    def _contraction(self, factor_ids: List[int], variables: Tuple[str, ...], observed: FrozenSet[str],
+                     heuristic: str, cliques: List[Tuple[List[int], int]]) -> Tuple[Contraction, List[str]]:
+        """Return the contraction of the factors into the joint of variables, and its elimination order
+
+        The cardinalities and number of factors of each product it forms are appended to cliques.
+        """
+        # a deterministic factor is used as a 0/1 indicator over the parents if its variable is observed,
+        # as a dense table if its variable is queried, and otherwise as an index array
+        kinds = []
+        scopes = []
+        for i in factor_ids:
+            scope = self.factors[i][0]
+            if i not in self.deterministic:
+                kinds.append("dense")
+            elif scope[0] in observed:
+                kinds.append("indicator")
+            elif scope[0] in variables:
+                kinds.append("onehot")
+            else:
+                kinds.append("index")
+            scope = scope if kinds[-1] in ["dense", "onehot"] else scope[1:]
+            scopes.append(tuple(v for v in scope if v not in observed))
+        active = list(range(len(scopes)))
+        gathers = []
+        for k in [k for k in active if kinds[k] == "index"]:
+            var = self.factors[factor_ids[k]][0][0]
+            active.remove(k)
+            for t in [t for t in active if var in scopes[t]]:
+                new_scope = tuple(v for v in scopes[t] if v != var) + tuple(v for v in scopes[k] if v not in scopes[t])
+                template = []
+                for v in scopes[t]:
+                    shape = [self.cardinality[u] if u == v else 1 for u in new_scope]
+                    template.append(None if v == var else np.arange(self.cardinality[v]).reshape(shape))
+                perm = sorted(range(len(scopes[k])), key=lambda axis: new_scope.index(scopes[k][axis]))
+                shape = [self.cardinality[u] if u in scopes[k] else 1 for u in new_scope]
+                gathers.append((t, k, template, scopes[t].index(var), perm, shape))
+                scopes[t] = new_scope
+                cliques.append(([self.cardinality[v] for v in new_scope], 1))
+
+        order = elimination_order([scopes[i] for i in active],
+                                  {v for i in active for v in scopes[i]} - set(variables),
+                                  self.cardinality, heuristic)
+        steps = []
+
+        def add_step(ids: List[int], output: Tuple[str, ...]) -> None:
+            letters = {}
+            for v in [v for i in ids for v in scopes[i]] + list(output):
+                if v not in letters:
+                    if len(letters) == len(string.ascii_letters):
+                        raise ValueError(f"query {list(variables)} is too large for the einsum backend")
+                    letters[v] = string.ascii_letters[len(letters)]
+            subscripts = ",".join("".join(letters[v] for v in scopes[i]) for i in ids)
+            subscripts += "->" + "".join(letters[v] for v in output)
+            path: Union[bool, list] = False
+            if len(ids) > 2:
+                # the path only depends on the shapes, so the dummy operands are zero-stride views of a scalar
+                dummies = [np.broadcast_to(np.empty(()), [self.cardinality[v] for v in scopes[i]]) for i in ids]
+                path = np.einsum_path(subscripts, *dummies, optimize="greedy")[0]
+            steps.append((ids, subscripts, path))
+            scopes.append(output)
+            cliques.append(([self.cardinality[v] for v in letters], len(ids)))
+
+        for var in order:
+            ids = [i for i in active if var in scopes[i]]
+            output = tuple(sorted({u for i in ids for u in scopes[i]} - {var}))
+            add_step(ids, output)
+            active = [i for i in active if i not in ids] + [len(scopes) - 1]
+        add_step(active, variables)
+        return (factor_ids, kinds, gathers, steps), order
+
+    def pruning_stats(self, variables: List[str], evidence: List[str] = None) -> Dict[str, int]:
+        """Return the number of CPDs in the model, and the number that are barren, d-separated
+        and relevant, for a query of variables given the evidence variables"""
+        stats = self.explain(variables, evidence)
+        return {k: stats[k] for k in ["cpds", "barren", "d_separated", "relevant"]}
+
+    def explain(self, variables: List[str], evidence: List[str] = None, heuristic: str = None) -> Dict[str, Any]:
+        """Return the plan for a query of variables given the evidence variables, without running it
+
+        Besides the pruning statistics and the number of deterministic variables substituted
+        with their parents, the result has the heuristic and elimination order used, and the
+        predicted treewidth, size in bytes of the largest factor, and number of flops.
+        """
+        return dict(self._plan(tuple(variables), frozenset(evidence if evidence else []), heuristic)[2])
+
+    def _check_memory(self, stats: Dict[str, Any]) -> None:
+        if self.memory_budget is not None and stats["max_factor_bytes"] > self.memory_budget:
+            raise MemoryError(f"inference needs a factor of {stats['max_factor_bytes']} bytes, "
+                              f"which exceeds the memory budget of {self.memory_budget} bytes")
+
+    def _joint(self, variables: List[str], evidence: Dict[str, Any]) -> np.ndarray:
+        """Return the unnormalized joint of variables and evidence, with axes in the order of variables"""
+        index = {v: self._state_index(v, state) for v, state in evidence.items()}
+        contraction, normalizer, stats = self._plan(tuple(variables), frozenset(evidence))
+        self._check_memory(stats)
+        joint = self._contract(contraction, index)
+        if normalizer is not None:
+            joint = joint * self._contract(normalizer, index)
+        return joint
+
+    def _contract(self, contraction: Contraction, index: Dict[str, int]) -> np.ndarray:
+        factor_ids, kinds, gathers, steps = contraction
+        operands = []
+        for i, kind in zip(factor_ids, kinds):
+            scope, values = self.factors[i]
+            axes = scope[1:] if i in self.deterministic else scope
+            if index:
+                values = values[tuple(index.get(v, slice(None)) for v in axes)]
+            if kind == "indicator":
+                values = (values == index[scope[0]]).astype(float)
+            elif kind == "onehot":
+                values = np.moveaxis(np.eye(self.cardinality[scope[0]])[values], -1, 0)
+            operands.append(values)
+        for target, k, template, axis, perm, shape in gathers:
+            indices = list(template)
+            indices[axis] = np.transpose(operands[k], perm).reshape(shape)
+            operands[target] = operands[target][tuple(indices)]
+        for ids, subscripts, path in steps:
+            operands.append(np.einsum(subscripts, *[operands[i] for i in ids], optimize=path))
+        return operands[-1]
+
+    def _factor(self, variables: List[str], values: np.ndarray) -> DiscreteFactor:
+        return DiscreteFactor(variables, [self.cardinality[v] for v in variables], values,
+                              state_names={v: self.state_names[v] for v in variables})
+
+    def query(self, variables: List[str], evidence: Dict[str, Any] = None, joint: bool = True,
+              show_progress: bool = True) -> Union[DiscreteFactor, Dict[str, DiscreteFactor]]:
+        """Return the distribution of variables given evidence, as BeliefPropagation.query
+
+        The factor's axes follow the order of variables. With joint=False, a dictionary
+        with the marginal distribution of each variable is returned instead.
+        """
+        evidence = evidence if evidence else {}
+        common_vars = set(variables).intersection(evidence)
+        if common_vars:
+            raise ValueError(f"Can't have the same variables in both `variables` and `evidence`. "
+                             f"Found in both: {common_vars}")
+        values = self._joint(list(variables), evidence)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = values / values.sum()
+        if joint:
+            return self._factor(list(variables), values)
+        marginals = {}
+        for axis, v in enumerate(variables):
+            others = tuple(i for i in range(len(variables)) if i != axis)
+            marginals[v] = self._factor([v], values.sum(axis=others))
+        return marginals
+
+
+def inference_engine(model: BayesianModel, backend: str = "bp", intervention: Dict[str, Any] = None,
+                     memory_budget: int = None):
+    """Return an inference engine for model: BeliefPropagation ("bp") or EinsumInference ("einsum")
+
+    Interventions are only supported by the einsum backend. For the bp backend, the memory
+    budget is checked against the largest clique of a min-fill elimination of the whole model,
+    which estimates the largest clique of the junction tree."""
+    if backend == "einsum":
+        return EinsumInference(model, intervention, memory_budget=memory_budget)
+    elif backend == "bp" and not intervention:
+        if memory_budget is not None:
+            scopes = [cpd.variables for cpd in model.get_cpds()]
+            cardinality = {cpd.variable: cpd.variable_card for cpd in model.get_cpds()}
+            size = max_clique_bytes(scopes, elimination_order(scopes, set(cardinality), cardinality), cardinality)
+            if size > memory_budget:
+                raise MemoryError(f"the junction tree needs a clique of about {size} bytes, "
+                                  f"which exceeds the memory budget of {memory_budget} bytes")
+        return BeliefPropagation(model)
+    elif backend == "bp":
+        raise ValueError("the bp backend does not support interventions")
+    raise ValueError(f"unknown inference backend {backend}, choose from {BACKENDS}")
@@ -11,6 +11,8 @@ import itertools
 from pgmpy.inference import BeliefPropagation
 import networkx as nx
 from core.cpd import UniformRandomCPD
+from core.inference import inference_engine, EinsumInference
+from core.parallel import WorkerPool
 import matplotlib.pyplot as plt
 import operator
 from collections import defaultdict
@@ -18,8 +20,12 @@ from collections import deque
 import copy
 import matplotlib.cm as cm
 from analyze.get_paths import get_motifs, get_motif
+from analyze.trimming import trimmed_links
 
 
+def _get_ev(macid, bp, dec_list: List[int], row: int):
+    """MACID._get_ev, with the arguments in the order used by a WorkerPool"""
+    return macid._get_ev(dec_list, row, bp)
 
 
 class MACID(BayesianModel):
@@ -36,11 +42,13 @@ class MACID(BayesianModel):
         self.reversed_acyclic_ordering = list(reversed(self.get_acyclic_topological_ordering()))
         self.numDecisions = len(self.reversed_acyclic_ordering)
         self.cpds_to_add = {}
+        self.memory_budget = None  # bytes; inference that needs a larger factor raises a MemoryError
 
     def copy(self):
-        model_copy = MACID(node_types=self.node_types)
+        # the edges are needed when the MACID is constructed, to compute the decision ordering
+        model_copy = MACID(list(self.edges()), node_types=self.node_types, utility_domains=self.utility_domains)
+        model_copy.memory_budget = self.memory_budget
         model_copy.add_nodes_from(self.nodes())
-        model_copy.add_edges_from(self.edges())
         if self.cpds:
             model_copy.add_cpds(*[cpd.copy() for cpd in self.cpds])
         return model_copy
@@ -65,7 +73,7 @@ class MACID(BayesianModel):
                 cpd = self.cpds_to_add[var]
                 if hasattr(cpd, "initialize_tabular_cpd"):
                     cpd.initialize_tabular_cpd(self)
-                if hasattr(cpd, "values"):
+                if hasattr(cpd, "variables"):  # initialized, without building a FunctionCPD's table
                     super(MACID, self).add_cpds(cpd)
                     del self.cpds_to_add[var]
 
@@ -523,12 +531,11 @@ class MACID(BayesianModel):
         agent_dec = self.decision_nodes[agent] #decision made by this agent (this incentive is currently only proven to hold for the single decision case)
         agent_utils = self.utility_nodes[agent] #this agent's utility nodes
 
-        trimmed_graph = self.copy()
-        d_par = self.get_parents(*agent_dec)
-        nonrequisite_nodes = [n for n in d_par if not self.has_info_inc(n, agent)]
-
-        for node in nonrequisite_nodes:
-            trimmed_graph.remove_edge(node, *agent_dec)
+        # the trimmed MACID only has the graph structure, without CPDs
+        removed = set(trimmed_links(self, agent_dec, agent_utils))
+        trimmed_graph = MACID([edge for edge in self.edges if edge not in removed],
+                              node_types=self.node_types, utility_domains=self.utility_domains)
+        trimmed_graph.add_nodes_from(self.nodes)
         return trimmed_graph
 
 
@@ -910,7 +917,7 @@ class MACID(BayesianModel):
         return trees_queue
 
 
-    def _reduce_tree_once(self, queue:List[str], bp):
+    def _reduce_tree_once(self, queue:List[str], pool: WorkerPool):
         #finds node not yet evaluated and then updates tree by evaluating this node - we apply this repeatedly to fill up all nodes in the tree
         tree = queue.pop(0)
         for row in range(len(tree) -2, -1,-1):
@@ -919,18 +926,18 @@ class MACID(BayesianModel):
                 if node_full:
                     continue
                 else:    # if node is empty => update it by finding maximum children
-                    queue_update = self._max_childen(tree, row, col, queue, bp)
+                    queue_update = self._max_childen(tree, row, col, queue, pool)
                     return queue_update
 
-    def _max_childen(self, tree, row: int, col: int, queue, bp):
+    def _max_childen(self, tree, row: int, col: int, queue, pool: WorkerPool):
         # adds to the queue the tree(s) filled with the node updated with whichever child(ren) yield the most utilty for the agent making the decision.
+        # the pool holds this MACID and its inference engine, and evaluates the children (see _PSNE_finder)
         cardinalities = map(self.get_cardinality, self.all_decision_nodes)
         decision_cardinalities = dict(zip(self.all_decision_nodes, cardinalities)) #returns a dictionary matching each decision with its cardinality
 
-        l = []
         dec_num_act = decision_cardinalities[self.reversed_acyclic_ordering[row]]  # number of possible actions for that decision
-        for indx in range (col*dec_num_act, (col*dec_num_act)+dec_num_act):   # using col*dec_num_act and (col*dec_num_act)+dec_num_act so we iterate over all actions that agent is considering
-            l.append(self._get_ev(tree[row+1][indx], row, bp))
+        # using col*dec_num_act and (col*dec_num_act)+dec_num_act so we iterate over all actions that agent is considering
+        l = pool.map(_get_ev, [(tree[row+1][indx], row) for indx in range(col*dec_num_act, (col*dec_num_act)+dec_num_act)])
         max_indexes = [i for i, j in enumerate(l) if j == max(l)]
 
         for i in range(len(max_indexes)):
@@ -985,26 +992,39 @@ class MACID(BayesianModel):
         root_node_full = bool(tree[0][0])
         return root_node_full
 
-    def _PSNE_finder(self):
+    def _PSNE_finder(self, backend: str = "bp", n_jobs: int = 1):
         """this finds all pure strategy subgame perfect NE when the strategic relevance graph is acyclic
         - first initialises the maid with uniform random conditional probability distributions at every decision.
         - then fills up a queue with trees containing each solution
-        - the queue will contain only one entry (tree) if there's only one pure strategy subgame perfect NE"""
+        - the queue will contain only one entry (tree) if there's only one pure strategy subgame perfect NE
+        - backend selects the inference engine used by _get_ev: "bp" or "einsum" (see core.inference)
+        - with n_jobs > 1 (or -1 for all CPUs), the children of each tree node are evaluated by a pool of processes,
+          which receive the MACID and its inference engine once. The result is identical to the serial one."""
         self.random_instantiation_dec_nodes()
 
 
 
 
-        bp = BeliefPropagation(self)
+        bp = inference_engine(self, backend, memory_budget=self.memory_budget)
         queue = self._instantiate_initial_tree()
-        while not self._stopping_condition(queue):
-            queue = self._reduce_tree_once(queue, bp)
+        with WorkerPool(n_jobs, self, bp) as pool:
+            while not self._stopping_condition(queue):
+                queue = self._reduce_tree_once(queue, pool)
         return queue
 
-    def get_all_PSNE(self):
+    def explain_query(self, query: List[str], context: Dict = None, heuristic: str = "min_fill") -> Dict:
+        """Return the einsum backend's plan for a query of the MACID given a context, without running it
+
+        The plan has the pruning statistics, the elimination order found with the heuristic
+        ("min_fill", "min_weight" or "weighted_min_fill"), and the predicted treewidth,
+        size in bytes of the largest factor, and number of flops (see core.inference)."""
+        engine = EinsumInference(self, memory_budget=self.memory_budget)
+        return engine.explain(query, list(context.keys()) if context else [], heuristic)
+
+    def get_all_PSNE(self, backend: str = "bp", n_jobs: int = 1):
         """yields all pure strategy subgame perfect NE when the strategic relevance graph is acyclic
         !should still decide how the solutions are best displayed! """
-        solutions = self._PSNE_finder()
+        solutions = self._PSNE_finder(backend, n_jobs)
         solution_array = []
         for tree in solutions:
             for row in range(len(tree)-1):
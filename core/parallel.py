@@ -0,0 +1,61 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more contributor license
+# agreements; and to You under the Apache License, Version 2.0.
+
+from __future__ import annotations
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, List, Sequence, Tuple
+
+_shared: Tuple = ()  # the shared arguments, in a worker process
+
+
+def _set_shared(*shared: Any) -> None:
+    global _shared
+    _shared = shared
+
+
+def _call(func: Callable, args: Sequence) -> Any:
+    return func(*_shared, *args)
+
+
+class WorkerPool:
+    """A pool of n_jobs worker processes that call functions with some shared leading arguments
+
+    The shared arguments (e.g. a model and its compiled inference engine) are sent to each worker
+    once, when the pool starts, so that each task only carries its own arguments.
+    With n_jobs=1 the functions are called in this process, and n_jobs=-1 uses all CPUs.
+    If the number of tasks is given, no more workers than tasks are started.
+    Use the pool as a context manager, so that the workers are shut down.
+    """
+
+    def __init__(self, n_jobs: int, *shared: Any, tasks: int = None):
+        self.n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+        if self.n_jobs < 1:
+            raise ValueError(f"n_jobs must be positive or -1, not {n_jobs}")
+        if tasks is not None:
+            self.n_jobs = max(1, min(self.n_jobs, tasks))
+        self.shared = shared
+        self._executor = None
+        if self.n_jobs > 1:
+            self._executor = ProcessPoolExecutor(self.n_jobs, initializer=_set_shared, initargs=shared)
+
+    def map(self, func: Callable, args_list: List[Sequence]) -> List:
+        """Return [func(*shared, *args) for args in args_list]
+
+        func must be picklable, e.g. a module-level function or a method referenced through its class.
+        """
+        if self._executor is None:
+            return [func(*self.shared, *args) for args in args_list]
+        chunksize = max(1, len(args_list) // (4 * self.n_jobs))
+        return list(self._executor.map(_call, [func] * len(args_list), args_list, chunksize=chunksize))
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self) -> WorkerPool:
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
@@ -0,0 +1,158 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more contributor license
+# agreements; and to You under the Apache License, Version 2.0.
+
+"""Save and load CIDs and MACIDs, with their CPDs
+
+A model is saved as a directory containing:
+- model.json, with the format version, the model type ("CID" or "MACID"), the nodes and edges,
+  the node roles (decision_nodes and utility_nodes, or node_types and utility_domains for a MACID,
+  as lists of key-value pairs),
+  and for each CPD its class, label, parents (evidence), their cardinalities, its state names,
+  and the name of the file holding its table
+- one .npy file per CPD. For a FunctionCPD this is the output index (the position of the variable's
+  state for each joint assignment of the parents, with one axis per parent), for other CPDs it is the
+  probability table (with the variable's axis first, followed by one axis per parent)
+
+State names must be strings, numbers, booleans or None. A FunctionCPD's function is not saved,
+so a loaded FunctionCPD computes its values by looking them up in the table (see TableFunction).
+
+load() memory-maps the tables, so it only reads model.json, and a table is only read from disk
+when (and to the extent that) it is used.
+"""
+
+from __future__ import annotations
+import json
+import os
+import tempfile
+from typing import Any, BinaryIO, Callable, Dict, List, Union
+import numpy as np
+import networkx as nx
+from pgmpy.factors.discrete import TabularCPD
+from pgmpy.models import BayesianModel
+from core.cid import CID, _plain
+from core.macid import MACID
+from core.cpd import UniformRandomCPD, FunctionCPD, DecisionDomain, TableFunction, _init_without_table
+
+FORMAT_VERSION = 1
+CPD_CLASSES = {cls.__name__: cls for cls in [TabularCPD, UniformRandomCPD, DecisionDomain, FunctionCPD]}
+
+
+def _json_state_names(state_names: Dict[str, List]) -> Dict[str, List]:
+    json_state_names = {}
+    for variable, values in state_names.items():
+        json_state_names[variable] = [_plain(value) for value in values]
+        for value in json_state_names[variable]:
+            if value is not None and not isinstance(value, (str, int, float, bool)):
+                raise ValueError(f"can't save state name {value!r} of {variable}")
+    return json_state_names
+
+
+def _replace_file(path: str, data: Callable[[BinaryIO], None]) -> None:
+    """Write a file with data, and move it into place at path
+
+    A model loaded from path keeps memory-mapping the tables it replaces, so it can be saved in place.
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            data(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def save(model: Union[CID, MACID], path: str) -> None:
+    """Save the model, with its CPDs, to the directory path (see the module docstring for the format)
+
+    The files are replaced rather than overwritten, so a model can be saved to the path it was loaded from.
+    """
+    if model.cpds_to_add:
+        raise ValueError(f"can't save uninitialized CPDs for {sorted(model.cpds_to_add)}")
+    os.makedirs(path, exist_ok=True)
+    meta: Dict[str, Any] = {"format": FORMAT_VERSION,
+                            "type": "MACID" if isinstance(model, MACID) else "CID",
+                            "nodes": list(model.nodes), "edges": list(model.edges)}
+    if isinstance(model, MACID):
+        # as lists of pairs, since the agents need not be strings
+        meta["node_types"] = list(model.node_types.items())
+        meta["utility_domains"] = list(model.utility_domains.items()) if model.utility_domains else None
+    else:
+        meta["decision_nodes"] = model.decision_nodes
+        meta["utility_nodes"] = model.utility_nodes
+
+    meta["cpds"] = []
+    for i, cpd in enumerate(model.cpds):
+        cls = type(cpd).__name__
+        if cls not in CPD_CLASSES:
+            raise ValueError(f"can't save CPD of class {cls} for {cpd.variable}")
+        if getattr(cpd, "output_index", None) is not None:
+            table = cpd.output_index
+        else:
+            table = cpd.values
+            if cls == "FunctionCPD":
+                cls = "TabularCPD"  # the table has been changed, so it may no longer be deterministic
+        filename = f"cpd_{i}.npy"
+        _replace_file(os.path.join(path, filename), lambda f: np.save(f, np.ascontiguousarray(table)))
+        meta["cpds"].append({"variable": cpd.variable, "class": cls,
+                             "label": getattr(cpd, "label", None),
+                             "evidence": cpd.variables[1:],
+                             "evidence_card": [int(c) for c in cpd.cardinality[1:]],
+                             "state_names": _json_state_names(cpd.state_names),
+                             "file": filename})
+
+    _replace_file(os.path.join(path, "model.json"), lambda f: f.write(json.dumps(meta, indent=1).encode()))
+
+
+def load(path: str, mmap: bool = True) -> Union[CID, MACID]:
+    """Load a model saved with save()
+
+    With mmap=True, the CPD tables are memory-mapped (read-only) rather than read into memory.
+    """
+    with open(os.path.join(path, "model.json")) as f:
+        meta = json.load(f)
+    if meta.get("format") != FORMAT_VERSION:
+        raise ValueError(f"unsupported format {meta.get('format')} in {path}")
+
+    edges = [tuple(edge) for edge in meta["edges"]]
+    if meta["type"] == "MACID":
+        utility_domains = dict(meta["utility_domains"]) if meta["utility_domains"] else None
+        model = MACID(edges, node_types=dict(meta["node_types"]), utility_domains=utility_domains)
+        model.add_nodes_from(meta["nodes"])
+    else:
+        model = CID([], decision_nodes=[], utility_nodes=[])
+        # the edges were saved from an acyclic graph, so pgmpy's per-edge cycle check is bypassed
+        nx.DiGraph.add_nodes_from(model, meta["nodes"])
+        nx.DiGraph.add_edges_from(model, edges)
+        model.decision_nodes = meta["decision_nodes"]
+        model.utility_nodes = meta["utility_nodes"]
+
+    domains = {entry["variable"]: entry["state_names"][entry["variable"]] for entry in meta["cpds"]}
+    cpds = []
+    for entry in meta["cpds"]:
+        variable, evidence, cls = entry["variable"], entry["evidence"], entry["class"]
+        state_names = entry["state_names"]
+        table = np.load(os.path.join(path, entry["file"]), mmap_mode="r" if mmap else None,
+                        allow_pickle=False).view(np.ndarray)
+        if cls == "FunctionCPD":
+            f = TableFunction([domains[p] for p in evidence], domains[variable], table)
+            cpd = FunctionCPD(variable, f, evidence, state_names={variable: state_names[variable]},
+                              label=entry["label"])
+            cpd.output_index = table
+            cpd._values = None
+        else:
+            if cls == "TabularCPD":
+                cpd = TabularCPD.__new__(TabularCPD)
+            elif cls == "DecisionDomain":
+                cpd = DecisionDomain(variable, state_names[variable])
+            else:
+                cpd = UniformRandomCPD(variable, state_names[variable], label=entry["label"])
+            cpd.values = table
+        _init_without_table(cpd, variable, evidence, entry["evidence_card"], state_names)
+        cpds.append(cpd)
+
+    # the CPDs are already initialized, so they are added without re-initializing them
+    BayesianModel.add_cpds(model, *cpds)
+    if isinstance(model, CID):
+        model._model_changed()
+    return model
@@ -134,10 +134,10 @@ def _add_sufficient_recall(cid: CID, dec1: str, dec2: str, utility_node: str) ->
     cid2 = cid.copy()
     cid2.add_edge('pi', dec1)
 
-    while cid2.is_active_trail('pi', utility_node, observed=cid.get_parents(dec2) + [dec2]):
+    while True:
         path = find_active_path(cid2, 'pi', utility_node, cid.get_parents(dec2) + [dec2])
         if path is None:
-            raise Exception("couldn't find path even though there should be an active trail")
+            break
         while True:
             i = random.randrange(1, len(path) - 1)
             # print('consider {}--{}--{}'.format(path[i-1], path[i], path[i+1]),end='')
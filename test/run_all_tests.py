@@ -5,11 +5,17 @@ from test.test_cpd import TestCPD
 from test.test_examples import TestExamples
 from test.test_notebooks import TestNotebooks
 from test.test_cid import TestCID
+from test.test_inference import TestInference
+from test.test_cache import TestCache
+from test.test_serialize import TestSerialize
 
 if __name__ == '__main__':
     # All tests can also be run with python3 -m unittest
     suiteList = [unittest.defaultTestLoader.loadTestsFromTestCase(TestCID),
                  unittest.defaultTestLoader.loadTestsFromTestCase(TestCPD),
+                 unittest.defaultTestLoader.loadTestsFromTestCase(TestInference),
+                 unittest.defaultTestLoader.loadTestsFromTestCase(TestCache),
+                 unittest.defaultTestLoader.loadTestsFromTestCase(TestSerialize),
                  unittest.defaultTestLoader.loadTestsFromTestCase(TestExamples),
                  unittest.defaultTestLoader.loadTestsFromTestCase(TestAnalyze),
                  unittest.defaultTestLoader.loadTestsFromTestCase(TestNotebooks)]
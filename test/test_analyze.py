@@ -1,12 +1,17 @@
 import sys, os
+import itertools
 import unittest
+import networkx as nx
 sys.path.insert(0, os.path.abspath('.'))
 
-from analyze.effects import introduced_total_effect, total_effect
-from analyze.value_of_information import admits_voi, admits_voi_list
+from analyze.effects import introduced_total_effect, total_effect, trimmed
+from analyze.get_paths import find_active_path, iter_active_paths
+from analyze.value_of_information import admits_voi, admits_voi_list, voi, voi_all
+from core.cid import CID
+from core.macid import MACID
 from core.cpd import FunctionCPD
 
-from examples.simple_cids import get_minimal_cid
+from examples.simple_cids import get_minimal_cid, get_2dec_cid
 from examples.story_cids import get_introduced_bias
 
 
@@ -16,6 +21,60 @@ class TestAnalyze(unittest.TestCase):
         cid = get_introduced_bias()
         self.assertTrue(admits_voi(cid, 'D', 'A'))
         self.assertEqual(set(admits_voi_list(cid, 'D')), {'A', 'X', 'Z', 'Y'})
+        self.assertEqual(admits_voi_list(get_2dec_cid(), 'D1'), ['S1'])
+        self.assertEqual(admits_voi_list(get_2dec_cid(), 'D2'), ['S2'])
+        self.assertFalse(admits_voi(get_2dec_cid(), 'D2', 'S1'))  # S1 only matters through S2
+        with self.assertRaises(ValueError):
+            admits_voi(cid, 'D', 'W')
+
+    def test_trimmed(self):
+        cid = CID([('D1', 'D2'), ('S', 'D2'), ('S', 'U'), ('D2', 'U')], decision_nodes=['D1', 'D2'],
+                  utility_nodes=['U'])
+        self.assertEqual(set(trimmed(cid).edges), {('S', 'D2'), ('S', 'U'), ('D2', 'U')})
+        self.assertTrue(cid.has_edge('D1', 'D2'))
+        self.assertEqual(set(trimmed(get_introduced_bias()).edges), set(get_introduced_bias().edges))
+        self.assertEqual(trimmed(cid).get_cpds(), [])
+        macid = MACID([('S', 'D'), ('X', 'D'), ('S', 'U'), ('D', 'U')],
+                      node_types={1: {'D': ['D'], 'U': ['U']}, 'C': ['S', 'X']})
+        self.assertEqual(set(macid.edges) - set(macid.dreduction(1).edges), {('X', 'D')})
+        self.assertFalse(macid.has_info_inc('X', 1))
+
+    def test_voi_all(self):
+        cid = get_introduced_bias()
+        table = voi_all(cid, 'D')
+        self.assertEqual([node for node, _ in table], ['X', 'Y', 'Z', 'A'])
+        for node, value in table:
+            self.assertAlmostEqual(value, voi(cid, 'D', node))
+        self.assertEqual(voi_all(cid, 'D', n_jobs=2), table)
+        self.assertEqual(voi_all(get_2dec_cid(), 'D1'), [('S1', 0)])
+
+    def test_find_active_path(self):
+        cid = CID([('A', 'B'), ('B', 'C'), ('C', 'D'), ('A', 'D'), ('E', 'B')], decision_nodes=[], utility_nodes=[])
+        self.assertEqual(find_active_path(cid, 'A', 'D', []), ['A', 'D'])
+        self.assertEqual(find_active_path(cid, 'D', 'E', []), ['D', 'C', 'B', 'E'])
+        self.assertEqual(find_active_path(cid, 'D', 'E', ['C']), ['D', 'A', 'B', 'E'])
+        self.assertEqual(find_active_path(cid, 'D', 'E', ['A', 'C']), None)
+        self.assertEqual(find_active_path(cid, 'A', 'E', ['D']), ['A', 'B', 'E'])
+        self.assertEqual(find_active_path(cid, 'A', 'D', ['A']), None)
+        chain = nx.DiGraph([(i, i + 1) for i in range(5000)])  # longer than the recursion limit
+        self.assertEqual(find_active_path(chain, 5000, 0, []), list(range(5000, -1, -1)))
+
+    def test_iter_active_paths(self):
+        cid = CID([('A', 'B'), ('B', 'C'), ('C', 'D'), ('A', 'D'), ('E', 'B')], decision_nodes=[], utility_nodes=[])
+        self.assertCountEqual(iter_active_paths(cid, 'A', 'D', []), [['A', 'D'], ['A', 'B', 'C', 'D']])
+        self.assertEqual(list(iter_active_paths(cid, 'A', 'D', [], max_length=2)), [['A', 'D']])
+        self.assertEqual(list(iter_active_paths(cid, 'A', 'D', [], max_length=1)), [['A', 'D']])
+        self.assertEqual(list(iter_active_paths(cid, 'A', 'D', [], max_length=0)), [])
+        self.assertEqual(list(iter_active_paths(cid, 'A', 'A', [], max_length=0)), [['A']])
+        self.assertEqual(list(iter_active_paths(cid, 'A', 'E', [])), [])
+        self.assertCountEqual(iter_active_paths(cid, 'D', 'E', ['C']), [['D', 'A', 'B', 'E']])
+        # a chain of 30 diamonds has 2**30 paths, which are generated lazily
+        ladder = nx.DiGraph()
+        for i in range(30):
+            ladder.add_edges_from([(2 * i, 2 * i + 1), (2 * i, 2 * i + 2), (2 * i + 1, 2 * i + 2)])
+        paths = [tuple(path) for path in itertools.islice(iter_active_paths(ladder, 0, 60, []), 100)]
+        self.assertEqual(len(set(paths)), 100)
+        self.assertTrue(all(path[0] == 0 and path[-1] == 60 for path in paths))
 
     def testTotalEffect(self):
         cid = get_minimal_cid()
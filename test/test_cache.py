@@ -0,0 +1,79 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more contributor license
+# agreements; and to You under the Apache License, Version 2.0.
+
+import sys, os
+sys.path.insert(0, os.path.abspath('.'))
+import unittest
+import tempfile
+from unittest import mock
+import numpy as np
+from examples.simple_cids import get_3node_cid, get_5node_cid
+from core.cache import SolutionCache
+from core.cid import CID
+
+
+class TestCache(unittest.TestCase):
+
+    # @unittest.skip("")
+    def test_content_hash(self):
+        cid = get_5node_cid()
+        self.assertEqual(cid.content_hash(), get_5node_cid().content_hash())
+        self.assertEqual(cid.content_hash(), cid.copy().content_hash())
+        cid2 = get_5node_cid()
+        cid2.impute_random_policy()
+        self.assertNotEqual(cid.content_hash(), cid2.content_hash())
+        cid3 = get_5node_cid()
+        cid3.remove_edge('S1', 'D')
+        self.assertNotEqual(cid.content_hash(), cid3.content_hash())
+
+    # @unittest.skip("")
+    def test_solve_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = SolutionCache(directory)
+            policy = get_5node_cid().solve(cache=cache)
+            with mock.patch.object(CID, "impute_optimal_policy") as impute:
+                cached = get_5node_cid().solve(cache=cache)
+                impute.assert_not_called()
+            self.assertEqual(policy.keys(), cached.keys())
+            for d in policy:
+                self.assertTrue(np.array_equal(policy[d].get_values(), cached[d].get_values()))
+                self.assertEqual(policy[d].variables, cached[d].variables)
+                self.assertEqual(policy[d].state_names, cached[d].state_names)
+                self.assertEqual(str(policy[d]), str(cached[d]))  # the table can be printed
+            with self.assertRaises(ValueError):
+                get_5node_cid().solve(tabular=False, cache=cache)
+
+    # @unittest.skip("")
+    def test_expected_utility_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = SolutionCache(directory)
+            cid = get_3node_cid()
+            cid.impute_optimal_policy()
+            eu = cid.expected_utility({'S': 1}, cache=cache)
+            with mock.patch.object(CID, "expected_value") as expected_value:
+                self.assertEqual(cid.expected_utility({'S': 1}, cache=cache), eu)
+                expected_value.assert_not_called()
+            self.assertEqual(cid.expected_utility({'S': 0}, cache=cache),
+                             cid.expected_utility({'S': 0}))
+
+    # @unittest.skip("")
+    def test_eviction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = SolutionCache(directory)
+            for i, key in enumerate(["a", "b", "c"]):
+                cache.save(key, x=np.zeros(100))
+                os.utime(cache._path(key), (i, i))
+            cache.load("a")  # marks "a" as recently used
+            cache.max_bytes = 2 * os.path.getsize(cache._path("a"))
+            cache.save("d", x=np.zeros(100))
+            self.assertNotIn("b", cache)
+            self.assertNotIn("c", cache)
+            self.assertIn("a", cache)
+            self.assertIn("d", cache)
+            cache.clear()
+            self.assertIsNone(cache.load("a"))
+
+
+if __name__ == "__main__":
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestCache)
+    unittest.TextTestRunner().run(suite)
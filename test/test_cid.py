@@ -4,11 +4,14 @@
 import sys, os
 sys.path.insert(0, os.path.abspath('.'))
 import unittest
+import pickle
 import numpy as np
 from examples.simple_cids import get_3node_cid, get_5node_cid, get_5node_cid_with_scaled_utility, get_2dec_cid, \
-    get_minimal_cid
+    get_minimal_cid, get_insufficient_recall_cid
 from examples.story_cids import get_introduced_bias
 from pgmpy.factors.discrete import TabularCPD
+from core.cid import _optimal_action
+from core.cpd import UniformRandomCPD
 
 
 class TestCID(unittest.TestCase):
@@ -21,12 +24,58 @@ class TestCID(unittest.TestCase):
         cpd = three_node.get_cpds('D').values
         self.assertTrue(np.array_equal(cpd, np.array([[1, 0], [0, 1]])))
 
+    # @unittest.skip("")
+    def test_add_cpds_reinitializes_only_changed(self):
+        cid = get_introduced_bias()
+        index_u = cid.get_cpds('U').output_index
+        cid.add_cpds(UniformRandomCPD('A', [0, 1]))
+        self.assertIs(cid.get_cpds('U').output_index, index_u)
+        cid.add_cpds(UniformRandomCPD('A', [0, 2]))  # X = A*Z changes domain, and so do Y and U
+        self.assertEqual(cid.get_cpds('Y').state_names['Y'], [0, 1, 2, 3])
+        self.assertEqual(cid.get_cpds('U').state_names['U'], [-9, -4, -1, 0])
+        cid.add_edge('A', 'D')
+        cid.add_cpds(UniformRandomCPD('Z', [0, 1]))
+        self.assertEqual(cid.get_cpds('D').variables, ['D', 'X', 'A'])
+
     def test_query(self):
         three_node = get_3node_cid()
         with self.assertRaises(Exception):
             three_node._query(['U'], {})
         with self.assertRaises(Exception):
             three_node._query(['U'], {'D': 0})
+        self.assertEqual(three_node._relevant_decisions(['U'], ['D']), ['D'])
+        self.assertEqual(three_node._relevant_decisions(['S'], []), [])
+        mech_graph = three_node._relevance_cache[1]
+        self.assertEqual(three_node._relevant_decisions(['U'], ['S']), ['D'])
+        self.assertIs(three_node._relevance_cache[1], mech_graph)
+        three_node.remove_edge('D', 'U')
+        self.assertEqual(three_node._relevant_decisions(['U'], ['S']), [])
+        self.assertIsNot(three_node._relevance_cache[1], mech_graph)
+
+    # @unittest.skip("")
+    def test_inference_engine_cache(self):
+        three_node = get_3node_cid()
+        three_node.impute_random_policy()
+        three_node.expected_utility({})
+        engine = three_node._inference_engine()
+        self.assertIs(three_node._inference_engine(), engine)
+        three_node.impute_optimal_policy()
+        self.assertIsNot(three_node._inference_engine(), engine)
+        key = three_node._engines[0]
+        three_node.remove_edge('S', 'D')
+        self.assertNotEqual((three_node._structure_version, three_node._cpd_version), key)
+        key = (three_node._structure_version, three_node._cpd_version)
+        three_node.remove_edges_from([('D', 'U')])
+        self.assertNotEqual((three_node._structure_version, three_node._cpd_version), key)
+        key = (three_node._structure_version, three_node._cpd_version)
+        three_node.remove_nodes_from(['U'])
+        self.assertNotEqual((three_node._structure_version, three_node._cpd_version), key)
+        cid = get_introduced_bias()
+        cid.impute_random_policy()
+        cid.expected_utility({})
+        cid.remove_cpds(cid.get_cpds('A'))
+        with self.assertRaises(ValueError):  # rather than using the engine compiled with the CPD of A
+            cid.expected_utility({})
 
     # @unittest.skip("")
     def test_expected_utility(self):
@@ -41,12 +90,39 @@ class TestCID(unittest.TestCase):
         eu001 = five_node.expected_utility({'D': 0, 'S1': 0, 'S2': 1})
         self.assertEqual(eu001, 1)
 
+    # @unittest.skip("")
+    def test_expected_value(self):
+        cid = get_5node_cid_with_scaled_utility()
+        cid.impute_random_policy()
+        self.assertEqual(cid.expected_value(['U1', 'U2'], {}), [5.0, 1.0])
+        self.assertEqual(cid.expected_value(['U2', 'U1'], {'D': 0, 'S1': 0}), [1.0, 10.0])
+        self.assertEqual(cid.expected_value(['U2', 'U1'], {'D': 0, 'S1': 0}, joint=False), [1.0, 10.0])
+        self.assertEqual(cid.expected_utility({'D': 1}, joint=True), cid.expected_utility({'D': 1}))
+
+    # @unittest.skip("")
+    def test_expected_utility_table(self):
+        five_node = get_5node_cid()
+        five_node.impute_random_policy()
+        table = five_node.expected_utility_table(['S1', 'S2', 'D'])
+        self.assertEqual(table.shape, (2, 2, 2))
+        for s1, s2, d in np.ndindex(*table.shape):
+            self.assertAlmostEqual(table[s1, s2, d], five_node.expected_utility({'S1': s1, 'S2': s2, 'D': d}))
+        self.assertTrue(np.allclose(five_node.expected_utility_table(['U1']), [0.5, 1.5]))
+        self.assertAlmostEqual(five_node.expected_utility_table([]), five_node.expected_utility({}))
+        minimal = get_minimal_cid()
+        minimal.impute_random_policy()
+        self.assertTrue(np.array_equal(minimal.expected_utility_table([], intervene={'A': 1}), 1))
+
     # @unittest.skip("")
     def test_sufficient_recall(self):
         two_decisions = get_2dec_cid()
         self.assertEqual(two_decisions.check_sufficient_recall(), True)
         two_decisions.remove_edge('S2', 'D2')
         self.assertEqual(two_decisions.check_sufficient_recall(), False)
+        (decision1, decision2, utility), = two_decisions.sufficient_recall_violations()
+        self.assertEqual({decision1, decision2, utility}, {'D1', 'D2', 'U'})
+        insufficient = get_insufficient_recall_cid()
+        self.assertEqual(len(insufficient.sufficient_recall_violations()), 1)
 
     # @unittest.skip("")
     def test_solve(self):
@@ -55,6 +131,7 @@ class TestCID(unittest.TestCase):
         solution = three_node.solve()  # check that it can be solved repeatedly
         cpd2 = solution['D']
         self.assertTrue(np.array_equal(cpd2.values, np.array([[1, 0], [0, 1]])))
+        self.assertIn('S(0)', str(cpd2))  # the parents' state names are kept, so the table can be printed
         three_node.add_cpds(cpd2)
         self.assertEqual(three_node.expected_utility({}), 1)
 
@@ -65,6 +142,28 @@ class TestCID(unittest.TestCase):
         two_decisions.add_cpds(*list(solution.values()))
         self.assertEqual(two_decisions.expected_utility({}), 1)
 
+    # @unittest.skip("")
+    def test_solve_tabular_matches_function_policy(self):
+        for cid in [get_3node_cid(), get_5node_cid(), get_2dec_cid(), get_introduced_bias()]:
+            tabular = cid.solve()
+            function = cid.solve(tabular=False)
+            for d in cid.decision_nodes:
+                self.assertIsInstance(tabular[d], TabularCPD)
+                self.assertTrue(np.array_equal(tabular[d].values, function[d].values))
+
+    # @unittest.skip("")
+    def test_solve_parallel(self):
+        for cid in [get_5node_cid(), get_2dec_cid(), get_introduced_bias()]:
+            for tabular in [True, False]:
+                serial = cid.solve(tabular=tabular)
+                parallel = cid.solve(tabular=tabular, n_jobs=2)
+                for d in cid.decision_nodes:
+                    self.assertTrue(np.array_equal(serial[d].values, parallel[d].values))
+        cid = get_5node_cid()
+        cid.impute_random_policy()
+        self.assertTrue(np.array_equal(cid.expected_utility_table(['S1', 'D'], n_jobs=-1),
+                                       cid.expected_utility_table(['S1', 'D']), equal_nan=True))
+
     # @unittest.skip("")
     def test_scaled_utility(self):
         cid = get_5node_cid_with_scaled_utility()
@@ -81,6 +180,42 @@ class TestCID(unittest.TestCase):
         eu_opt = cid.expected_utility({})
         self.assertEqual(eu_ce, eu_opt)
 
+    # @unittest.skip("")
+    def test_copy(self):
+        cid = get_introduced_bias()
+        cid.impute_random_policy()
+        eu = cid.expected_utility({})
+        cid_copy = cid.copy()
+        self.assertEqual(set(cid_copy.edges), set(cid.edges))
+        self.assertTrue(np.shares_memory(cid_copy.get_cpds('U').output_index, cid.get_cpds('U').output_index))
+        with self.assertRaises(ValueError):
+            cid_copy.get_cpds('U').values[0, 0, 0] = 0.5
+        cid_copy.add_cpds(UniformRandomCPD('A', [0, 2]))
+        self.assertEqual(cid_copy.get_cpds('U').state_names['U'], [-9, -4, -1, 0])
+        self.assertEqual(cid.get_cpds('U').state_names['U'], [-4, -1, 0])
+        cid_copy.remove_edge('A', 'X')
+        self.assertTrue(cid.has_edge('A', 'X'))
+        self.assertEqual(cid.expected_utility({}), eu)
+
+    # @unittest.skip("")
+    def test_pickle(self):
+        for cid in [get_5node_cid(), get_2dec_cid(), get_introduced_bias()]:
+            cid.impute_random_policy()
+            eu = cid.expected_utility({})
+            loaded = pickle.loads(pickle.dumps(cid))
+            self.assertIsNone(loaded._engines)
+            self.assertEqual(loaded.expected_utility({}), eu)
+            self.assertEqual(loaded.content_hash(), cid.content_hash())
+            loaded.impute_optimal_policy()
+            pickle.loads(pickle.dumps(cid.solve(tabular=False)))
+        # a worker receives the model and its compiled engine separately, and reuses the engine
+        cid = get_3node_cid()
+        cid.impute_random_policy()
+        bp = cid._inference_engine()
+        loaded = pickle.loads(pickle.dumps(cid))
+        self.assertEqual(_optimal_action(loaded, bp, 'D', (1,)), 1)
+        self.assertIs(loaded._inference_engine(), bp)
+
     # @unittest.skip("")
     def test_intervention(self):
         cid = get_minimal_cid()
@@ -91,6 +226,20 @@ class TestCID(unittest.TestCase):
             self.assertEqual(cid.expected_value(['B'], {})[0], a)
         self.assertEqual(cid.expected_value(['B'], {}, intervene={'A': 1})[0], 1)
 
+    # @unittest.skip("")
+    def test_intervention_overlay(self):
+        cid = get_introduced_bias()
+        cid.impute_conditional_expectation_decision('D', 'Y')
+        for intervention in [{'A': 0}, {'A': 1}, {'Z': 1, 'X': 0}, {'D': cid.get_cpds('D').state_names['D'][1]}]:
+            intervened = cid.copy()
+            intervened.intervene(intervention)
+            for variable in ['X', 'D', 'Y', 'U']:
+                self.assertAlmostEqual(cid.expected_value([variable], {}, intervene=intervention)[0],
+                                       intervened.expected_value([variable], {})[0])
+            self.assertAlmostEqual(cid.expected_utility({'X': 0}, intervene=intervention),
+                                   intervened.expected_utility({'X': 0}))
+        self.assertIs(cid._inference_engine({'A': 1}), cid._inference_engine({'A': 1}))
+
 
 if __name__ == "__main__":
     suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestCID)
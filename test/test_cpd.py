@@ -1,8 +1,12 @@
+import copy
 import numpy as np
+import pickle
 import unittest
+from unittest import mock
 import sys, os
 sys.path.insert(0, os.path.abspath('.'))
-from core.cpd import UniformRandomCPD, FunctionCPD
+from core.cid import CID
+from core.cpd import UniformRandomCPD, FunctionCPD, TableFunction
 from examples.simple_cids import get_minimal_cid
 from examples.story_cids import get_introduced_bias
 
@@ -32,6 +36,73 @@ class TestCPD(unittest.TestCase):
         self.assertEqual(cpd_a.get_cardinality(['A'])['A'], 1)
         self.assertEqual(cpd_a.get_state_names('A', 0), 2)
 
+    def test_function_cpd_evaluations(self):
+        cid = get_introduced_bias()
+        calls = []
+
+        def f(d, y):
+            calls.append((d, y))
+            return -(d - y) ** 2
+        cpd_u = FunctionCPD('U', f, evidence=['D', 'Y'])
+        cpd_u.initialize_tabular_cpd(cid)
+        self.assertEqual(len(calls), 2 * 3)  # once per joint assignment of D and Y
+        cpd_v = FunctionCPD('U', lambda d, y: -(d - y) ** 2, evidence=['D', 'Y'], vectorized=True)
+        cpd_v.initialize_tabular_cpd(cid)
+        self.assertEqual(cpd_v.state_names, cpd_u.state_names)
+        self.assertTrue(np.array_equal(cpd_v.values, cpd_u.values))
+        cpd_c = FunctionCPD('U', lambda d, y: 1, evidence=['D', 'Y'], vectorized=True)
+        cpd_c.initialize_tabular_cpd(cid)  # constant outputs are broadcast to every parent assignment
+        self.assertTrue(np.array_equal(cpd_c.get_values(), np.ones((1, 6))))
+
+    def test_function_cpd_output_index(self):
+        cid = get_introduced_bias()
+        cpd_y = cid.get_cpds('Y')
+        self.assertEqual(cpd_y.output_index.tolist(), [[0, 1], [1, 2]])  # Y = X + Z
+        self.assertTrue(np.array_equal(cpd_y.values[:, 1, 1], [0, 0, 1]))
+        cid.impute_random_policy()
+        cid.expected_utility({})
+        for cpd in cid.get_cpds():  # the dense tables are not kept after inference
+            if isinstance(cpd, FunctionCPD):
+                self.assertIsNone(cpd.__dict__.get("_values"))
+        cpd_y.normalize()  # tables set by pgmpy replace the output index
+        self.assertIsNone(cpd_y.output_index)
+        self.assertTrue(np.array_equal(cpd_y.values[:, 1, 1], [0, 0, 1]))
+        with self.assertRaises(AttributeError):
+            FunctionCPD('Y', lambda x: x, evidence=['X']).values
+
+    def test_function_cpd_label(self):
+        with mock.patch('core.cpd.getsourcelines') as getsourcelines:
+            cpd = FunctionCPD('B', lambda a: a + 1, evidence=['A'])
+            cpd_copy = cpd.copy()
+            cid = get_introduced_bias()
+            cid.copy()
+            getsourcelines.assert_not_called()
+        self.assertEqual(cpd_copy.label, "a + 1")
+        self.assertEqual(cpd.copy().label, "a + 1")
+        self.assertEqual(FunctionCPD('B', lambda a: a, evidence=['A'], label="id").copy().label, "id")
+        self.assertEqual(UniformRandomCPD('A', [0, 1], label="coin").copy().label, "coin")
+
+    def test_function_cpd_pickle(self):
+        cid = get_introduced_bias()
+        cpd_y = cid.get_cpds('Y')
+        loaded = pickle.loads(pickle.dumps(cpd_y))
+        self.assertIsInstance(loaded.f, TableFunction)
+        self.assertEqual(loaded.f(1, 1), 2)
+        self.assertEqual(loaded.label, cpd_y.label)
+        self.assertTrue(np.array_equal(loaded.values, cpd_y.values))
+        self.assertNotIsInstance(cpd_y.f, TableFunction)  # pickling leaves the original unchanged
+        cpd_y.freeze()
+        self.assertIsInstance(cpd_y.f, TableFunction)
+        self.assertEqual(cpd_y.label, "x + z")
+        uninitialized = FunctionCPD('Y', lambda x: x, evidence=['X'])
+        with self.assertRaises((pickle.PicklingError, AttributeError)):  # there's no table to replace f with
+            pickle.dumps(uninitialized)
+        self.assertIs(copy.deepcopy(uninitialized).f, uninitialized.f)
+        pending = CID([('X', 'Y')], [], [])
+        pending.add_cpds(uninitialized)  # can't be initialized before X has a CPD
+        self.assertIn('Y', copy.deepcopy(pending).cpds_to_add)
+        self.assertEqual(pickle.loads(pickle.dumps(FunctionCPD('Y', abs, evidence=['X']))).f, abs)
+
     def test_updated_decision_names(self):
         cid = get_introduced_bias()
         self.assertEqual(cid.get_cpds('D').state_names['D'], [0, 1])
@@ -0,0 +1,156 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more contributor license
+# agreements; and to You under the Apache License, Version 2.0.
+
+import sys, os
+sys.path.insert(0, os.path.abspath('.'))
+import unittest
+import itertools
+import numpy as np
+from pgmpy.inference import BeliefPropagation
+from pgmpy.models import BayesianModel
+from pgmpy.factors.discrete import TabularCPD
+from examples.simple_cids import get_3node_cid, get_5node_cid, get_2dec_cid
+from examples.story_cids import get_introduced_bias
+from examples.story_macids import umbrella
+from core.inference import EinsumInference, inference_engine, elimination_order, HEURISTICS
+from core.cid import CID
+from core.cpd import UniformRandomCPD, FunctionCPD, DecisionDomain
+
+
+class TestInference(unittest.TestCase):
+
+    # @unittest.skip("")
+    def test_einsum_matches_bp(self):
+        for cid in [get_3node_cid(), get_5node_cid(), get_2dec_cid(), get_introduced_bias()]:
+            cid.impute_random_policy()
+            bp = BeliefPropagation(cid)
+            einsum = EinsumInference(cid)
+            decision = cid.decision_nodes[0]
+            evidence = {decision: cid.get_cpds(decision).state_names[decision][-1]}
+            queries = [([node], {}) for node in cid.nodes] + [(cid.utility_nodes, {}), (cid.utility_nodes, evidence)]
+            for query, evidence in queries:
+                expected = bp.query(query, evidence, show_progress=False)
+                factor = einsum.query(query, evidence)
+                self.assertEqual(factor.variables, query)
+                values = np.moveaxis(expected.values, [expected.variables.index(v) for v in query],
+                                     range(len(query)))
+                self.assertTrue(np.allclose(factor.values, values))
+
+    # @unittest.skip("")
+    def test_einsum_evidence(self):
+        cid = get_introduced_bias()
+        cid.impute_random_policy()
+        einsum = EinsumInference(cid)
+        self.assertTrue(np.allclose(einsum.query(['Y'], {'A': 1}).values, [0.5, 0, 0.5]))
+        # as in pgmpy, states that are not state names are used as indices
+        self.assertEqual(cid.get_cpds('U').state_names['U'], [-4, -1, 0])
+        self.assertEqual(einsum.query(['D'], {'U': 1}), einsum.query(['D'], {'U': -1}))
+        marginals = einsum.query(['Y', 'U'], {'A': 1}, joint=False)
+        self.assertTrue(np.allclose(marginals['U'].values, einsum.query(['U'], {'A': 1}).values))
+        self.assertEqual(len(einsum._plans), 4)  # the two queries of D share a plan
+        with self.assertRaises(ValueError):
+            einsum.query(['Y'], {'Y': 0})
+        for state in ['one', 3, -2, 1.5]:  # neither a state name nor an index
+            with self.assertRaises(ValueError):
+                einsum.query(['D'], {'U': state})
+
+    # @unittest.skip("")
+    def test_einsum_pruning(self):
+        cid = get_introduced_bias()
+        cid.impute_random_policy()
+        einsum = EinsumInference(cid)
+        self.assertEqual(einsum.pruning_stats(['X']), {"cpds": 6, "barren": 3, "d_separated": 0, "relevant": 3})
+        self.assertEqual(einsum.pruning_stats(['U'], ['D', 'Y']),
+                         {"cpds": 6, "barren": 0, "d_separated": 5, "relevant": 1})
+        unpruned = EinsumInference(cid, prune=False)
+        self.assertEqual(unpruned.pruning_stats(['X'])["relevant"], 6)
+        for query, evidence in [(['X'], {}), (['U'], {'D': 0, 'Y': 1}), (['Y', 'D'], {'Z': 1})]:
+            self.assertEqual(einsum.query(query, evidence), unpruned.query(query, evidence))
+
+    # @unittest.skip("")
+    def test_einsum_impossible_evidence(self):
+        # X is always 0, and the CPDs of S, X and D are d-separated from U given X and D
+        cid = CID([('S', 'X'), ('X', 'D'), ('X', 'U'), ('D', 'U')], ['D'], ['U'])
+        cid.add_cpds(UniformRandomCPD('S', [0, 1]), FunctionCPD('X', lambda s: 0, ['S'], state_names={'X': [0, 1]}),
+                     DecisionDomain('D', [0, 1]), FunctionCPD('U', lambda x, d: x + d, ['X', 'D']))
+        cid.impute_random_policy()
+        self.assertEqual(EinsumInference(cid).pruning_stats(['U'], ['X', 'D'])["d_separated"], 3)
+        self.assertTrue(np.isnan(EinsumInference(cid).query(['U'], {'X': 1, 'D': 0}).values).all())
+        for backend in ["bp", "einsum"]:
+            self.assertEqual(cid.expected_utility({'X': 0}, backend=backend), 0.5)
+            with self.assertRaises(Exception):
+                cid.expected_utility({'X': 1}, backend=backend)
+
+    # @unittest.skip("")
+    def test_elimination_order(self):
+        # a chain A - B - C - D, and a star around E
+        scopes = [('A', 'B'), ('B', 'C'), ('C', 'D'), ('E', 'F'), ('E', 'G'), ('E', 'H')]
+        cardinality = {v: 2 for v in 'ABCDEFGH'}
+        self.assertEqual(elimination_order(scopes, {'B', 'E'}, cardinality, "min_fill"), ['B', 'E'])
+        self.assertEqual(elimination_order(scopes, {'A', 'B', 'C'}, cardinality, "min_weight"), ['A', 'B', 'C'])
+        # eliminating P or Q adds one fill-in edge, but the one between X and Y is larger
+        scopes = [('P', 'X'), ('P', 'Y'), ('Q', 'R'), ('Q', 'S')]
+        cardinality = {'P': 2, 'Q': 2, 'R': 2, 'S': 2, 'X': 3, 'Y': 3}
+        self.assertEqual(elimination_order(scopes, {'P', 'Q'}, cardinality, "min_fill"), ['P', 'Q'])
+        self.assertEqual(elimination_order(scopes, {'P', 'Q'}, cardinality, "weighted_min_fill"), ['Q', 'P'])
+        with self.assertRaises(ValueError):
+            elimination_order(scopes, {'A'}, cardinality, "max_fill")
+
+    # @unittest.skip("")
+    def test_explain_query(self):
+        cid = get_introduced_bias()
+        cid.impute_random_policy()
+        for heuristic in HEURISTICS:
+            plan = cid.explain_query(['U'], {'D': 0}, heuristic=heuristic)
+            self.assertEqual(plan["heuristic"], heuristic)
+            self.assertEqual(set(plan["order"]), {'A', 'Z'})
+            self.assertEqual(plan["deterministic"], 2)  # X and Y are substituted with their parents
+            self.assertEqual(plan["treewidth"], 2)
+            self.assertEqual(plan["max_factor_bytes"], 8 * 2 * 2 * 3)
+            self.assertGreater(plan["flops"], 0)
+        self.assertEqual(umbrella().explain_query(['A'])["relevant"], 4)
+        cid.memory_budget = 64
+        with self.assertRaises(MemoryError):
+            cid.expected_utility({'D': 0}, backend="einsum")
+        with self.assertRaises(MemoryError):
+            cid.expected_utility({'D': 0})
+        cid.memory_budget = 96
+        cid.expected_utility({'D': 0}, backend="einsum")
+
+    # @unittest.skip("")
+    def test_explain_large_query(self):
+        # each pair of 8 variables with 100 states has a common child, so eliminating one variable
+        # forms a product over all 8, of 8 * 100**8 bytes
+        xs = [f"X{i}" for i in range(8)]
+        pairs = list(itertools.combinations(xs, 2))
+        model = BayesianModel([(a, a + b) for a, b in pairs] + [(b, a + b) for a, b in pairs])
+        model.add_cpds(*[TabularCPD(x, 100, np.full((100, 1), 0.01)) for x in xs],
+                       *[TabularCPD(a + b, 2, np.full((2, 100 * 100), 0.5), [a, b], [100, 100]) for a, b in pairs])
+        evidence = {a + b: 0 for a, b in pairs}
+        einsum = EinsumInference(model, memory_budget=2**30)
+        self.assertEqual(einsum.explain(['X0'], list(evidence))["max_factor_bytes"], 8 * 100**8)
+        with self.assertRaises(MemoryError):
+            einsum.query(['X0'], evidence)
+
+    # @unittest.skip("")
+    def test_cid_backends(self):
+        cid = get_introduced_bias()
+        cid.impute_random_policy()
+        for context in [{}, {'A': 1}, {'D': 0, 'Z': 1}]:
+            self.assertAlmostEqual(cid.expected_utility(context, backend="einsum"), cid.expected_utility(context))
+            self.assertAlmostEqual(cid.expected_utility(context, intervene={'X': 1}, backend="einsum"),
+                                   cid.expected_utility(context, intervene={'X': 1}))
+        self.assertTrue(np.allclose(cid.expected_utility_table(['D', 'A'], backend="einsum"),
+                                    cid.expected_utility_table(['D', 'A']), equal_nan=True))
+        with self.assertRaises(ValueError):
+            inference_engine(cid, "unknown")
+
+    # @unittest.skip("")
+    def test_macid_backends(self):
+        self.assertEqual(umbrella().get_all_PSNE(backend="einsum"), umbrella().get_all_PSNE())
+        self.assertEqual(umbrella().get_all_PSNE(backend="einsum", n_jobs=2), umbrella().get_all_PSNE())
+
+
+if __name__ == "__main__":
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestInference)
+    unittest.TextTestRunner().run(suite)
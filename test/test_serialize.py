@@ -0,0 +1,97 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more contributor license
+# agreements; and to You under the Apache License, Version 2.0.
+
+import sys, os
+sys.path.insert(0, os.path.abspath('.'))
+import unittest
+import tempfile
+import numpy as np
+from pgmpy.factors.discrete import TabularCPD
+from examples.simple_cids import get_3node_cid, get_5node_cid
+from examples.story_cids import get_introduced_bias
+from examples.story_macids import umbrella
+from core.cpd import FunctionCPD, DecisionDomain, UniformRandomCPD
+from core.serialize import save, load
+
+
+class TestSerialize(unittest.TestCase):
+
+    # @unittest.skip("")
+    def test_save_load_cid(self):
+        for cid in [get_5node_cid(), get_introduced_bias()]:
+            cid.impute_random_policy()
+            with tempfile.TemporaryDirectory() as path:
+                save(cid, path)
+                loaded = load(path)
+                self.assertEqual(loaded.content_hash(), cid.content_hash())
+                self.assertEqual(loaded.decision_nodes, cid.decision_nodes)
+                self.assertEqual(loaded.utility_nodes, cid.utility_nodes)
+                for cpd in cid.cpds:
+                    self.assertEqual(type(loaded.get_cpds(cpd.variable)), type(cpd))
+                for backend in ["bp", "einsum"]:
+                    self.assertEqual(loaded.expected_utility({}, backend=backend), cid.expected_utility({}))
+
+    # @unittest.skip("")
+    def test_load_is_lazy(self):
+        cid = get_3node_cid()
+        cid.add_cpds(TabularCPD('D', 2, np.array([[1, 0], [0, 1]]), ['S'], [2],
+                                state_names={'D': [0, 1], 'S': [0, 1]}))
+        with tempfile.TemporaryDirectory() as path:
+            save(cid, path)
+            loaded = load(path)
+            self.assertIsInstance(loaded.get_cpds('D').values.base, np.memmap)
+            self.assertIsInstance(loaded.get_cpds('U').output_index.base, np.memmap)
+            self.assertEqual(loaded.get_cpds('D').state_names, cid.get_cpds('D').state_names)
+            self.assertEqual(loaded.expected_utility({}), 1)
+            self.assertNotIsInstance(load(path, mmap=False).get_cpds('D').values.base, np.memmap)
+
+    # @unittest.skip("")
+    def test_save_in_place(self):
+        cid = get_introduced_bias()
+        cid.impute_random_policy()
+        with tempfile.TemporaryDirectory() as path:
+            save(cid, path)
+            loaded = load(path)
+            save(loaded, path)  # the loaded model's tables are memory-mapped from the files it replaces
+            self.assertEqual(loaded.expected_utility({}), cid.expected_utility({}))
+            self.assertEqual(load(path).expected_utility({}), cid.expected_utility({}))
+            self.assertEqual(sorted(f for f in os.listdir(path) if f.endswith(".tmp")), [])
+
+    # @unittest.skip("")
+    def test_loaded_function_cpd(self):
+        cid = get_3node_cid()
+        with tempfile.TemporaryDirectory() as path:
+            save(cid, path)
+            loaded = load(path)
+        self.assertIsInstance(loaded.get_cpds('D'), DecisionDomain)
+        self.assertEqual(loaded.get_cpds('U').f(1, 1), 1)
+        self.assertEqual(loaded.get_cpds('U').f(0, 1), 0)
+        # the table function is used when the CPD is re-initialized
+        loaded.add_cpds(UniformRandomCPD('S', [0, 1]), update_all=True)
+        self.assertTrue(np.array_equal(loaded.get_cpds('U').values, cid.get_cpds('U').values))
+        loaded.impute_optimal_policy()
+        self.assertEqual(loaded.expected_utility({}), 1)
+
+    # @unittest.skip("")
+    def test_save_load_macid(self):
+        macid = umbrella()
+        with tempfile.TemporaryDirectory() as path:
+            save(macid, path)
+            loaded = load(path)
+        self.assertEqual(loaded.node_types, macid.node_types)
+        self.assertEqual(sorted(loaded.edges), sorted(macid.edges))
+        for cpd in macid.cpds:
+            self.assertTrue(np.array_equal(loaded.get_cpds(cpd.variable).values, cpd.values))
+
+    # @unittest.skip("")
+    def test_save_errors(self):
+        cid = get_3node_cid()
+        cid.add_cpds(FunctionCPD('U', lambda s, d: (s, d), evidence=['S', 'D']))
+        with tempfile.TemporaryDirectory() as path:
+            with self.assertRaises(ValueError):
+                save(cid, path)
+
+
+if __name__ == "__main__":
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestSerialize)
+    unittest.TextTestRunner().run(suite)